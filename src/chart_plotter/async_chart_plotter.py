@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+"""
+asyncio front end for ChartPlotter, for serving renders from an async web server
+"""
+
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from .chart_plotter import ChartPlotter, getWorkerContext, initTileWorker, renderChartWorker
+
+COALESCE_DECIMALS = 7  # Boxes that match to about a centimeter share one render
+
+
+class RenderQueueFull(Exception):
+    """Raised instead of queueing a render when max_queued renders are already waiting to start"""
+    pass
+
+
+class AsyncChartPlotter(object):
+    """
+    Runs ChartPlotter renders off the event loop, e.g. image = await AsyncChartPlotter(chart_plotter).plotChart(...)
+
+    Renders run in a pool of worker processes with their own copy of the ChartPlotter (workers=0 uses one thread and the
+    ChartPlotter itself, since GDAL handles can't be shared between threads). Requests for the same box, size, projection
+    and render settings while a render is running share it, and get the same image array back, so don't modify it in place.
+
+    At most max_in_flight renders are handed to the pool at once, and up to max_queued more wait for a slot. Past that,
+    plotChart raises RenderQueueFull. A render is cancelled when every request waiting on it is cancelled (e.g. the client
+    went away), unless a worker has already started on it.
+    """
+
+    def __init__(self, chart_plotter: ChartPlotter, workers=None, max_in_flight=None, max_queued=256):
+        self.chart_plotter = chart_plotter
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
+        self.max_in_flight = max_in_flight if max_in_flight is not None else max(1, self.workers) * 2
+        self.max_queued = max_queued
+
+        self.executor = None
+        self.executor_config_key = None
+        self.slots = None  # Semaphore, made on first use so it belongs to the running loop
+        self.slots_taken = 0
+
+        self.renders = {}  # Request key -> [render task, number of plotChart calls waiting on it, has a slot]
+
+    async def plotChart(self, lower_left, upper_right, width_px, height_px, projection=None):
+        config_key = self.chart_plotter.getRenderConfigKey()
+        request_key = getRequestKey(config_key, lower_left, upper_right, width_px, height_px, projection)
+
+        entry = self.renders.get(request_key)
+        if entry is None:
+            queued = self.getQueuedCount()
+            if queued >= self.max_queued:
+                raise RenderQueueFull("%d renders already waiting" % queued)
+
+            job = (list(lower_left), list(upper_right), width_px, height_px, projection)
+            entry = [None, 0, False]
+            entry[0] = asyncio.ensure_future(self.runRender(config_key, job, entry))
+            self.renders[request_key] = entry
+            entry[0].add_done_callback(lambda _: self.forgetRender(request_key, entry))
+
+        render = entry[0]
+        entry[1] += 1
+        try:
+            # Shielded so one client going away doesn't cancel the render for everyone else
+            return await asyncio.shield(render)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and not render.done():
+                render.cancel()
+                self.forgetRender(request_key, entry)  # Now, so a new request doesn't join it before its done callback runs
+
+    def forgetRender(self, request_key, entry):
+        if self.renders.get(request_key) is entry:
+            del self.renders[request_key]
+
+    async def runRender(self, config_key, job, entry):
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.max_in_flight)
+
+        await self.slots.acquire()
+        self.slots_taken += 1
+        entry[2] = True
+
+        loop = asyncio.get_event_loop()
+        try:
+            executor = self.getExecutor(config_key)
+            if self.workers == 0:
+                future = executor.submit(self.chart_plotter.plotChart, *job)
+            else:
+                future = executor.submit(renderChartWorker, *job)
+        except BaseException:
+            self.releaseSlot()
+            raise
+
+        # The slot is held until the worker is really done, even if this task gets cancelled first
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self.releaseSlot))
+        return await asyncio.wrap_future(future)
+
+    def releaseSlot(self):
+        self.slots_taken -= 1
+        self.slots.release()
+
+    def getExecutor(self, config_key):
+        """Pool whose workers have the current render settings, a new one is started when the settings change"""
+        if self.executor is not None and (self.workers == 0 or config_key == self.executor_config_key):
+            return self.executor
+
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)  # Renders already running on it still finish
+
+        if self.workers == 0:
+            self.executor = ThreadPoolExecutor(max_workers=1)
+        else:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=getWorkerContext(), initializer=initTileWorker,
+                                                initargs=(self.chart_plotter,))
+        self.executor_config_key = config_key
+        return self.executor
+
+    def getInFlightCount(self):
+        return len(self.renders)
+
+    def getQueuedCount(self):
+        """Renders that will still be waiting for a slot once every free slot is taken"""
+        without_slot = sum(1 for render, waiters, has_slot in self.renders.values() if not has_slot)
+        return max(0, without_slot - (self.max_in_flight - self.slots_taken))
+
+    async def close(self):
+        for render, waiters, has_slot in list(self.renders.values()):
+            render.cancel()
+
+        if self.executor is not None:
+            executor = self.executor
+            self.executor = None
+            await asyncio.get_event_loop().run_in_executor(None, executor.shutdown)
+
+
+def getRequestKey(config_key, lower_left, upper_right, width_px, height_px, projection):
+    box = tuple(round(float(value), COALESCE_DECIMALS) for value in list(lower_left) + list(upper_right))
+    return config_key, box, int(width_px), int(height_px), projection
@@ -9,9 +9,29 @@ class LayerCore(object):
     def __init__(self):
         self.dataSourceNames = []
 
-    def plotChart(self, lower_left, upper_right, width_px, height_pixels):
-        """Plots chart based on lat-lon coordinates"""
+    def plotChart(self, lower_left, upper_right, width_px, height_pixels, projection=None, out=None):
+        """Plots chart based on lat-lon coordinates, onto a grid in projection if one is given, and into out if one is given"""
+        return None
+
+    def plotChartWithAlpha(self, lower_left, upper_right, width_px, height_pixels, projection=None, out=None):
+        """
+        Same as plotChart, plus a uint8 alpha mask (0 transparent, 255 opaque) for stacking layers
+
+        The alpha mask is None if the whole image is opaque, which is what layers that don't override this give.
+        """
+        return self.plotChart(lower_left, upper_right, width_px, height_pixels, projection, out), None
+
+    def getOutputGrid(self, lower_left, upper_right, width_px, height_pixels, projection=None):
+        """
+        (projection, height) plotChart would really draw on, if the layer picks its own grid instead of the one it's given
+
+        None for layers that always draw on the grid they're asked for, which is what layers that don't override this give.
+        """
         return None
 
     def getDataSourceNames(self):
         return self.dataSourceNames
+
+    def getRenderConfig(self):
+        """Everything that changes what plotChart draws, used to key caches of rendered images"""
+        return {"class": type(self).__name__, "data_sources": self.dataSourceNames}
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+"""
+Persistent catalog of NOAA chart metadata, so startup doesn't have to open every chart
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+from dataclasses import dataclass, field
+
+from osgeo import ogr
+
+CATALOG_SCHEMA_VERSION = 1
+
+
+@dataclass
+class ChartInfo(object):
+    name: str
+    path: str
+    coverage: list
+    bounds: list = field(default_factory=list)  # [lon_min, lon_max, lat_min, lat_max]
+    scale: int = 0  # Compilation scale denominator, 0 if unknown
+    usage_band: int = 0  # 1 (overview) to 6 (berthing), 0 if unknown
+    layers: list = field(default_factory=list)
+
+
+class NOAACatalog(object):
+    """
+    SQLite file holding the metadata of every chart under a chart directory
+
+    Charts are keyed by path, and only re-read when their mtime or size changes.
+    """
+
+    def __init__(self, catalog_path):
+        try:
+            self.connection = sqlite3.connect(catalog_path)
+            self.createTables()
+        except sqlite3.Error as e:
+            print(f"Could not open chart catalog {catalog_path}, using an in-memory catalog: {e}")
+            self.connection = sqlite3.connect(":memory:")
+            self.createTables()
+
+        self.version = ""
+
+    def createTables(self):
+        schema_version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if schema_version != CATALOG_SCHEMA_VERSION:
+            self.connection.execute("DROP TABLE IF EXISTS charts")
+            self.connection.execute("PRAGMA user_version = {0}".format(CATALOG_SCHEMA_VERSION))
+
+        self.connection.execute("CREATE TABLE IF NOT EXISTS charts ("
+                                "path TEXT PRIMARY KEY, name TEXT, mtime INTEGER, size INTEGER, "
+                                "coverage TEXT, bounds TEXT, scale INTEGER, usage_band INTEGER, layers TEXT)")
+        self.connection.commit()
+
+    def update(self, chart_paths):
+        """Brings the catalog in line with chart_paths, and returns a ChartInfo for each of them in the same order"""
+        stored = {}
+        for row in self.connection.execute("SELECT path, name, mtime, size, coverage, bounds, scale, usage_band, layers FROM charts"):
+            stored[row[0]] = row
+
+        charts = []
+        changed_rows = []
+        version_hash = hashlib.sha1()
+
+        for chart_path in chart_paths:
+            stat = os.stat(chart_path)
+            version_hash.update("{0}:{1}:{2};".format(chart_path, stat.st_mtime_ns, stat.st_size).encode())
+
+            row = stored.pop(chart_path, None)
+            if row is None or row[2] != stat.st_mtime_ns or row[3] != stat.st_size:
+                chart_info = readChartInfo(chart_path)
+                if chart_info is None:
+                    continue
+                changed_rows.append((chart_path, chart_info.name, stat.st_mtime_ns, stat.st_size, json.dumps(chart_info.coverage),
+                                     json.dumps(chart_info.bounds), chart_info.scale, chart_info.usage_band, json.dumps(chart_info.layers)))
+            else:
+                chart_info = ChartInfo(name=row[1], path=chart_path, coverage=json.loads(row[4]), bounds=json.loads(row[5]),
+                                       scale=row[6], usage_band=row[7], layers=json.loads(row[8]))
+
+            charts.append(chart_info)
+
+        # Anything left in stored has been deleted from disk
+        if len(changed_rows) > 0 or len(stored) > 0:
+            self.connection.executemany("INSERT OR REPLACE INTO charts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", changed_rows)
+            self.connection.executemany("DELETE FROM charts WHERE path = ?", [(path,) for path in stored])
+            self.connection.commit()
+
+        self.version = version_hash.hexdigest()
+        return charts
+
+    def getVersion(self):
+        """Hash of the path, mtime and size of every chart, changes whenever any chart does"""
+        return self.version
+
+    def close(self):
+        self.connection.close()
+
+
+def readChartInfo(chart_path):
+    data_set = ogr.Open(chart_path)
+    if data_set is None:
+        print(f"Could not open chart {chart_path}")
+        return None
+
+    chart_name = os.path.splitext(os.path.basename(chart_path))[0]
+    layers = [data_set.GetLayerByIndex(i).GetDescription() for i in range(data_set.GetLayerCount())]
+    scale, usage_band = getScaleAndUsage(data_set)
+
+    if usage_band == 0 and len(chart_name) > 2 and chart_name[2].isdigit():
+        usage_band = int(chart_name[2])  # NOAA cell names encode the usage band, e.g. US5MA28M
+
+    return ChartInfo(name=chart_name, path=chart_path, coverage=getCoverage(data_set), bounds=getFileBounds(data_set),
+                     scale=scale, usage_band=usage_band, layers=layers)
+
+
+def getScaleAndUsage(data_set):
+    """Compilation scale and intended usage from the DSID record"""
+    layer = data_set.GetLayerByName("DSID")
+    if layer is None:
+        return 0, 0
+
+    layer.ResetReading()
+    feature = layer.GetNextFeature()
+    if feature is None:
+        return 0, 0
+
+    values = []
+    for key in ["DSPM_CSCL", "DSID_INTU"]:
+        index = feature.GetFieldIndex(key)
+        if index >= 0 and feature.IsFieldSet(index):
+            values.append(feature.GetFieldAsInteger(index))
+        else:
+            values.append(0)
+
+    return values[0], values[1]
+
+
+def getCoverage(data_set):
+    coverage_layer_index = -1
+    coverage_list = []
+
+    for coverage_layer_index in range(data_set.GetLayerCount()):
+        layer = data_set.GetLayerByIndex(coverage_layer_index)
+        if layer.GetDescription() == "M_COVR":
+            break
+
+    layer = data_set.GetLayerByIndex(coverage_layer_index)
+    layer.ResetReading()
+    nfeat = layer.GetFeatureCount()
+    for j in range(nfeat):  # The last feature is the full rectangle bounding box
+        points_list = []
+
+        feat = layer.GetNextFeature()
+        geom = feat.GetGeometryRef()
+        ring = geom.GetGeometryRef(0)
+        points = ring.GetPointCount()
+        for p in range(points):
+            lon, lat, z = ring.GetPoint(p)
+            points_list.append((lon, lat))
+
+        coverage_list.append(points_list)
+
+    return coverage_list
+
+
+def getFileBounds(file_data):
+    bounds = []
+
+    for i in range(file_data.GetLayerCount()):
+        layer = file_data.GetLayer(i)
+        x_min, x_max, y_min, y_max = layer.GetExtent()
+        if abs(x_min - x_max) > 0.000001 and abs(y_min - y_max) > 0.000001:  # Some layers are very small, so we don't care about them
+            if len(bounds) == 0:
+                bounds = [x_min, x_max, y_min, y_max]
+            else:
+                bounds[0] = min(bounds[0], x_min)
+                bounds[1] = max(bounds[1], x_max)
+                bounds[2] = min(bounds[2], y_min)
+                bounds[3] = max(bounds[3], y_max)
+
+    return bounds
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+"""
+Compiles the drawn layers of NOAA charts into GeoPackages, which load much faster than S-57 and have spatial indexes
+
+Also makes the in-memory simplified copies of charts used for zoomed out renders
+"""
+
+import os
+
+from osgeo import ogr
+
+# Attributes the renderer needs, everything else is left out of the compiled charts
+COMPILED_FIELDS = {"DEPARE": ["DRVAL1", "DRVAL2"],
+                   "DRGARE": ["DRVAL1", "DRVAL2"]}
+
+
+def getCompiledPath(compiled_dir, chart_name):
+    return os.path.join(compiled_dir, "{0}.gpkg".format(chart_name))
+
+
+def isCompiledChartFresh(chart_path, compiled_path):
+    if not os.path.exists(compiled_path):
+        return False
+
+    return os.stat(compiled_path).st_mtime_ns >= os.stat(chart_path).st_mtime_ns
+
+
+def compileChart(chart_path, compiled_path, layer_names):
+    """Copies the geometry (and COMPILED_FIELDS attributes) of layer_names from an S-57 chart into a GeoPackage"""
+    source = ogr.Open(chart_path)
+    if source is None:
+        raise Exception("could not open chart: %s" % chart_path)
+
+    # Build next to the final file, so readers never open a half written GeoPackage
+    temp_path = compiled_path + ".tmp"
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+
+    compiled = ogr.GetDriverByName("GPKG").CreateDataSource(temp_path)
+    if compiled is None:
+        raise Exception("could not create compiled chart: %s" % compiled_path)
+
+    for layer_name in layer_names:
+        source_layer = source.GetLayerByName(layer_name)
+        if source_layer is None:
+            continue
+
+        compileLayer(source_layer, compiled, layer_name, options=["SPATIAL_INDEX=YES"])
+
+    compiled = None
+    source = None
+    os.replace(temp_path, compiled_path)
+
+
+def simplifyLayer(source: ogr.DataSource, layer_name, tolerance, min_size):
+    """
+    Memory datasource with layer_name from source, simplified to tolerance, and roughly how many bytes it holds
+
+    Lines and areas with an envelope smaller than min_size in both directions get dropped, points are kept as they are.
+    The size is the WKB size of the geometry that was kept. Returns (None, 0) if source doesn't have the layer.
+    """
+
+    def simplifyGeometry(geometry: ogr.Geometry):
+        if ogr.GT_Flatten(geometry.GetGeometryType()) in [ogr.wkbPoint, ogr.wkbMultiPoint]:
+            return geometry
+
+        x_min, x_max, y_min, y_max = geometry.GetEnvelope()
+        if x_max - x_min < min_size and y_max - y_min < min_size:
+            return None
+
+        simplified = geometry.SimplifyPreserveTopology(tolerance)
+        if simplified is None or simplified.IsEmpty():
+            return None
+        return simplified
+
+    source_layer = source.GetLayerByName(layer_name)
+    if source_layer is None:
+        return None, 0
+
+    simplified_layer = ogr.GetDriverByName("Memory").CreateDataSource("")
+    size_bytes = compileLayer(source_layer, simplified_layer, layer_name, geometry_function=simplifyGeometry)
+    return simplified_layer, size_bytes
+
+
+class SimplifiedChart(object):
+    """Read-only stand-in for a chart datasource, made of simplified layers that are cached separately"""
+
+    def __init__(self, layer_sources):
+        self.layer_sources = layer_sources  # One single layer memory datasource per layer, in draw order
+
+    def GetLayerCount(self):
+        return len(self.layer_sources)
+
+    def GetLayerByIndex(self, index) -> ogr.Layer:
+        return self.layer_sources[index].GetLayer(0)
+
+    def GetLayer(self, index) -> ogr.Layer:
+        return self.GetLayerByIndex(index)
+
+    def GetLayerByName(self, layer_name) -> ogr.Layer:
+        for layer_source in self.layer_sources:
+            layer = layer_source.GetLayer(0)
+            if layer.GetName() == layer_name:
+                return layer
+
+        return None
+
+
+def compileLayer(source_layer: ogr.Layer, compiled: ogr.DataSource, layer_name, geometry_function=None, options=None):
+    """
+    Copies a layer's geometry and COMPILED_FIELDS attributes, passing geometries through geometry_function if given
+
+    Returns the WKB size of the geometry it copied
+    """
+    compiled_layer = compiled.CreateLayer(layer_name, source_layer.GetSpatialRef(), source_layer.GetGeomType(), options=options or [])
+
+    source_definition = source_layer.GetLayerDefn()
+    field_names = []
+    for field_name in COMPILED_FIELDS.get(layer_name, []):
+        field_index = source_definition.GetFieldIndex(field_name)
+        if field_index >= 0:
+            compiled_layer.CreateField(source_definition.GetFieldDefn(field_index))
+            field_names.append(field_name)
+
+    compiled_definition = compiled_layer.GetLayerDefn()
+    compiled_layer.StartTransaction()
+    size_bytes = 0
+
+    source_layer.ResetReading()
+    for source_feature in source_layer:
+        geometry = source_feature.GetGeometryRef()
+        if geometry is not None and geometry_function is not None:
+            geometry = geometry_function(geometry)
+        if geometry is None:
+            continue
+
+        feature = ogr.Feature(compiled_definition)
+        feature.SetGeometry(geometry)
+        size_bytes += geometry.WkbSize()
+        for field_name in field_names:
+            if source_feature.IsFieldSet(field_name):
+                feature.SetField(field_name, source_feature.GetField(field_name))
+        compiled_layer.CreateFeature(feature)
+
+    compiled_layer.CommitTransaction()
+    return size_bytes
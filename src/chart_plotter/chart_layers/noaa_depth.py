@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+"""
+Spatial indexes over the DEPARE areas and SOUNDG soundings of a NOAA chart, for looking up charted depth at many points at once
+"""
+
+import math
+from dataclasses import dataclass
+
+import numpy
+import shapely
+from shapely.strtree import STRtree
+from osgeo import ogr
+
+METERS_PER_DEGREE_LATITUDE = 111320.0
+
+
+@dataclass
+class DepthQuery(object):
+    """Depths at each query point, NaN where no chart has an answer"""
+    drval1: numpy.ndarray  # Shallow end of the DEPARE depth range, meters
+    drval2: numpy.ndarray  # Deep end of the DEPARE depth range, meters
+    sounding_depth: numpy.ndarray  # Nearest sounding, meters
+    sounding_distance_m: numpy.ndarray  # Distance to that sounding
+
+
+class ChartDepthIndex(object):
+    """
+    STRtrees over one chart's depth areas and soundings
+
+    Points are stored in a local equirectangular frame (longitude scaled by cos(latitude) at the chart's middle) so that
+    nearest sounding searches come out in meters without reprojecting anything.
+    """
+
+    def __init__(self, depth_areas, depth_ranges, soundings):
+        self.depth_areas = depth_areas
+        self.depth_ranges = depth_ranges  # N x 2 DRVAL1, DRVAL2
+        self.area_tree = STRtree(depth_areas)
+
+        self.sounding_depths = soundings[:, 2]
+        self.longitude_scale = math.cos(math.radians(numpy.mean(soundings[:, 1]))) if len(soundings) > 0 else 1.0
+        self.sounding_tree = STRtree(shapely.points(self.toLocal(soundings[:, 1], soundings[:, 0])))
+
+    def toLocal(self, latitudes, longitudes):
+        return numpy.column_stack((longitudes * self.longitude_scale, latitudes)) * METERS_PER_DEGREE_LATITUDE
+
+    def queryDepthAreas(self, latitudes, longitudes):
+        """DRVAL1 and DRVAL2 of the depth area each point is in, NaN outside every area"""
+        drval1 = numpy.full(len(latitudes), numpy.nan)
+        drval2 = numpy.full(len(latitudes), numpy.nan)
+        if len(self.depth_areas) == 0:
+            return drval1, drval2
+
+        point_indices, area_indices = self.area_tree.query(shapely.points(longitudes, latitudes), predicate="intersects")
+        drval1[point_indices] = self.depth_ranges[area_indices, 0]
+        drval2[point_indices] = self.depth_ranges[area_indices, 1]
+        return drval1, drval2
+
+    def queryNearestSoundings(self, latitudes, longitudes):
+        """Depth of and distance in meters to the nearest sounding of each point, NaN if the chart has none"""
+        depths = numpy.full(len(latitudes), numpy.nan)
+        distances = numpy.full(len(latitudes), numpy.nan)
+        if len(self.sounding_depths) == 0:
+            return depths, distances
+
+        points = shapely.points(self.toLocal(latitudes, longitudes))
+        (point_indices, sounding_indices), sounding_distances = self.sounding_tree.query_nearest(points, return_distance=True, all_matches=False)
+        depths[point_indices] = self.sounding_depths[sounding_indices]
+        distances[point_indices] = sounding_distances
+        return depths, distances
+
+
+def buildChartDepthIndex(chart: ogr.DataSource):
+    depth_areas = []
+    depth_ranges = []
+    depare = chart.GetLayerByName("DEPARE")
+    if depare is not None:
+        depare.ResetReading()
+        for feature in depare:
+            geometry = feature.GetGeometryRef()
+            if geometry is None:
+                continue
+            depth_areas.append(bytes(geometry.ExportToWkb()))
+            depth_ranges.append([getFieldOrNan(feature, "DRVAL1"), getFieldOrNan(feature, "DRVAL2")])
+
+    soundings = []
+    soundg = chart.GetLayerByName("SOUNDG")
+    if soundg is not None:
+        soundg.ResetReading()
+        for feature in soundg:
+            geometry = feature.GetGeometryRef()
+            if geometry is not None:
+                soundings.append(bytes(geometry.ExportToWkb()))
+
+    # Soundings are usually multipoints with the depth as Z
+    sounding_points = shapely.get_coordinates(shapely.from_wkb(soundings), include_z=True) if len(soundings) > 0 else numpy.zeros((0, 3))
+
+    return ChartDepthIndex(shapely.from_wkb(depth_areas), numpy.array(depth_ranges, dtype=float).reshape(-1, 2), sounding_points)
+
+
+def getFieldOrNan(feature: ogr.Feature, key):
+    index = feature.GetFieldIndex(key)
+    if index < 0 or not feature.IsFieldSet(index):
+        return numpy.nan
+    return feature.GetFieldAsDouble(index)
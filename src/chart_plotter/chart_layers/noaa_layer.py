@@ -4,30 +4,80 @@
 Uses osgeo rasterize function to turn NOAA vector charts into png images
 """
 
+import json
+import math
 import os
+from contextlib import contextmanager
 from typing import List
 
 import numpy
 from collections import OrderedDict
+from dataclasses import dataclass
 
 import osgeo.gdal
-from shapely.geometry import Polygon
-from dataclasses import dataclass
-from osgeo import gdal, ogr, osr
+from shapely import contains, contains_xy, from_wkb, prepare
+from shapely.geometry import box
+from osgeo import gdal, gdal_array, ogr, osr
 
 from .layer_core import LayerCore
-from chart_plotter.utility.conversions import getImageHeightFromWidth
+from .noaa_catalog import NOAACatalog, getFileBounds
+from .noaa_compiled import SimplifiedChart, compileChart, getCompiledPath, isCompiledChartFresh, simplifyLayer
+from .noaa_depth import ChartDepthIndex, DepthQuery, buildChartDepthIndex
+
+from chart_plotter.utility.conversions import boxDimensions, getImageHeightFromWidth
+from chart_plotter.utility.image_buffers import getImageBuffer
+from chart_plotter.utility import navigability_grid
+from chart_plotter.utility.lru_cache import LRUCache
+from chart_plotter.utility.navigability_grid import NavigabilityGrid
+from chart_plotter.utility.projections import getProjectionWkt, transformBounds
+from chart_plotter.utility.render_profiler import NULL_PROFILER
+from chart_plotter.utility.spatial_index import CoverageIndex
+
+# Smallest display scale denominator each usage band is meant for: overview, general, coastal, approach, harbor, berthing
+USAGE_BAND_MIN_SCALE = {1: 1500000, 2: 350000, 3: 90000, 4: 22000, 5: 4000, 6: 0}
+DISPLAY_PIXEL_SIZE_M = 0.00028  # Standard rendering pixel size used to turn meters per pixel into a display scale
+METERS_PER_DEGREE_LATITUDE = 111320.0
+
+# Layers drawn into navigability grids, in drawing order so worse classes land on top. None means split by depth
+NAVIGABILITY_LAYER_CLASSES = OrderedDict([("DEPARE", None),
+                                          ("DRGARE", None),
+                                          ("OBSTRN", navigability_grid.OBSTRUCTION),
+                                          ("UWTROC", navigability_grid.OBSTRUCTION),
+                                          ("WRECKS", navigability_grid.OBSTRUCTION),
+                                          ("PONTON", navigability_grid.LAND),
+                                          ("SLCONS", navigability_grid.LAND),
+                                          ("LNDARE", navigability_grid.LAND)])
+
+DEEP_WATER_CLASS = "DEPARE_DEEP"  # Class name for DEPARE areas deeper than shallow_water_depth
+
+BGR_BANDS = (3, 2, 1)  # Bands to burn RGB colors into, so they come out right in a BGR image buffer (see wrapImageBuffer)
 
 
 @dataclass
-class ChartInfo(object):
-    name: str
-    chartData: ogr.DataSource
-    coverage: list
+class RenderPlan(object):
+    chart_list: list  # Charts to draw, in draw order
+    raster_bounds: list  # [x_min, x_max, y_min, y_max] of the output in raster_projection
+    width_px: int
+    height_px: int
+    raster_projection: str  # WKT
+    projection: str  # What the caller asked for, None for the chart's own lat-lon grid
+    filter_bounds: list  # Bounds of the output in chart coordinates
+    meters_per_pixel: float
+
+    def createRaster(self, bands):
+        raster_image = createRasterImage(self.raster_bounds, self.width_px, self.height_px, bands=bands)
+        raster_image.SetProjection(self.raster_projection)
+        return raster_image
+
+    def wrapImage(self, image):
+        return wrapImageBuffer(image, self.raster_bounds, self.raster_projection)
+
+    def getImageBounds(self):
+        return [[self.raster_bounds[0], self.raster_bounds[2]], [self.raster_bounds[1], self.raster_bounds[3]]]
 
 
 class NOAALayer(LayerCore):
-    def __init__(self, chart_dir=None):
+    def __init__(self, chart_dir=None, max_open_charts=32, catalog_path=None, compiled_dir=None, simplified_cache_bytes=256 * 1024 * 1024):
         super(NOAALayer, self).__init__()
 
         if chart_dir is None:
@@ -87,23 +137,64 @@ class NOAALayer(LayerCore):
                                          })
 
         self.shallow_water_depth = 5  # Depth in meters for water to be considered "shallow"
+        self.scale_aware_selection = True  # Only draw the best scale chart for each area, see selectChartsForScale
+        self.simplify_geometry = True  # Simplify charts to the pixel size when zoomed out past their compilation scale
+        self.simplified_layers = LRUCache(simplified_cache_bytes, size_function=getSimplifiedLayerSize)  # (layer, bytes) pairs
+        self.layer_mask_cache = None  # See enableLayerMaskCache
+        self.indexed_rendering = False  # See setIndexedRendering
+        self.profiler = NULL_PROFILER  # See setProfiler
+        self.depth_indexes = LRUCache(64)  # See queryDepths
 
         self.tif_reproject = False
         self.tif_name = ""
         self.tif_projection = ""
         self.tif_bounds = [None, None]
 
-        # Loop through and figure out bounds
-        self.files = {}
+        # Charts are opened the first time a render needs them, and only max_open_charts stay open
+        self.open_charts = LRUCache(max_open_charts)
+        self.query_charts = LRUCache(4)  # Separate handles for feature queries, see iterFeaturesInBounds
+
+        # Chart metadata comes from the catalog, which only re-reads charts that changed since the last run
+        if catalog_path is None:
+            catalog_path = os.path.join(chart_dir, "chart_catalog.sqlite")
+        catalog = NOAACatalog(catalog_path)
+
+        chart_paths = []
         for chart_directory in files_to_load:
             chart_name = chart_directory.split("/")[-1]
-            chart_path = os.path.join(chart_directory, "{0}.000".format(chart_name))
-            self.files[chart_name] = ChartInfo(name=chart_name, chartData=ogr.Open(chart_path), coverage=[])
-            self.files[chart_name].coverage = self.getDataRegion(chart_name)
-            self.dataSourceNames.append(chart_name)
+            chart_paths.append(os.path.join(chart_directory, "{0}.000".format(chart_name)))
+
+        self.files = {}
+        self.coverage_index = CoverageIndex()
+        for chart_info in catalog.update(chart_paths):
+            self.files[chart_info.name] = chart_info
+            self.coverage_index.addItem(chart_info.name, chart_info.coverage)
+            self.dataSourceNames.append(chart_info.name)
+
+        self.catalog_version = catalog.getVersion()
+        catalog.close()
+
+        # Coverage polygons are only built once, lookups go through the STRtree
+        self.coverage_index.build()
+
+        # Charts compiled with compileCharts get rendered from their GeoPackage instead of the S-57 file
+        self.compiled_dir = compiled_dir if compiled_dir is not None else os.path.join(chart_dir, "compiled")
+        self.use_compiled_charts = True
+        self.compiled_charts = {}
+        self.compiled_layers = {}  # Layers in each compiled chart, read from the GeoPackage the first time it's used
+        for chart_name in self.files:
+            compiled_path = getCompiledPath(self.compiled_dir, chart_name)
+            if isCompiledChartFresh(self.files[chart_name].path, compiled_path):
+                self.compiled_charts[chart_name] = compiled_path
 
         # TODO: MASKS
 
+    def __getstate__(self):
+        # Handle pools and other LRUCaches pickle empty, so copies (e.g. in worker processes) open their own charts
+        state = self.__dict__.copy()
+        state["profiler"] = NULL_PROFILER  # Copies don't report back to this process
+        return state
+
     def setColorPalette(self, new_palette):
         self.color_palette.update(new_palette)
 
@@ -118,99 +209,663 @@ class NOAALayer(LayerCore):
     def setShallowWaterDepth(self, new_depth):
         self.shallow_water_depth = new_depth
 
+    def setScaleAwareSelection(self, scale_aware_selection):
+        self.scale_aware_selection = scale_aware_selection
+
+    def setGeometrySimplification(self, simplify_geometry):
+        self.simplify_geometry = simplify_geometry
+
+    def setMaxOpenCharts(self, max_open_charts):
+        self.open_charts.resize(max_open_charts)
+
+    def getChartData(self, chart_name) -> ogr.DataSource:
+        """Returns the open datasource for a chart, opening it if it isn't in the handle pool"""
+        chart_path = self.files[chart_name].path
+        return self.open_charts.getOrCreate(chart_name, lambda: openDataSource(chart_path))
+
+    def getRenderSource(self, chart_name) -> ogr.DataSource:
+        """Datasource to rasterize a chart from: the compiled GeoPackage if it's up to date, otherwise the S-57 chart"""
+        if self.use_compiled_charts and self.isCompiledChartUsable(chart_name):
+            return self.getCompiledChart(chart_name)
+
+        return self.getChartData(chart_name)
+
+    def getCompiledChart(self, chart_name) -> ogr.DataSource:
+        compiled_path = self.compiled_charts[chart_name]
+        return self.open_charts.getOrCreate(("compiled", chart_name), lambda: openDataSource(compiled_path))
+
+    def isCompiledChartUsable(self, chart_name):
+        """True if the chart has an up to date GeoPackage with every layer in layer_colors that the chart has"""
+        if chart_name not in self.compiled_charts:
+            return False
+
+        if chart_name not in self.compiled_layers:
+            try:
+                compiled = self.getCompiledChart(chart_name)
+            except Exception as e:
+                print(e)
+                return False
+            self.compiled_layers[chart_name] = {compiled.GetLayerByIndex(i).GetName() for i in range(compiled.GetLayerCount())}
+
+        compiled_layers = self.compiled_layers[chart_name]
+        chart_layers = self.files[chart_name].layers
+        return all(layer_name in compiled_layers for layer_name in self.layer_colors if layer_name in chart_layers)
+
+    def getChartForResolution(self, chart_name, meters_per_pixel) -> ogr.DataSource:
+        """
+        Datasource to rasterize a chart from at a given resolution
+
+        Once pixels are bigger than what the chart was compiled for, this is a copy of the drawn layers simplified to half a
+        pixel with sub-pixel features dropped. Layers are cached one by one per chart and per power of two pixel size, so they
+        get reused by every render at about the same scale and turning a layer on or off only simplifies that layer. The cache
+        is bounded by the geometry size of the layers it holds.
+        """
+        chart_info = self.files[chart_name]
+        chart_resolution = chart_info.scale * DISPLAY_PIXEL_SIZE_M
+        if not self.simplify_geometry or meters_per_pixel <= chart_resolution:
+            return self.getRenderSource(chart_name)
+
+        # Round the pixel size down to a power of two degrees, so the cached copy is never coarser than the render
+        zoom_band = math.floor(math.log2(meters_per_pixel / METERS_PER_DEGREE_LATITUDE))
+        band_pixel_size = 2.0 ** zoom_band
+        compiled = self.use_compiled_charts and self.isCompiledChartUsable(chart_name)
+        source = self.getRenderSource(chart_name)
+
+        layer_sources = []
+        for layer_name in self.layer_colors:
+            if layer_name not in chart_info.layers:
+                continue
+
+            key = (chart_name, zoom_band, layer_name, compiled)
+            simplified_layer, size_bytes = self.simplified_layers.getOrCreate(key, lambda: simplifyLayer(source, layer_name, band_pixel_size / 2.0, band_pixel_size))
+            if simplified_layer is not None:
+                layer_sources.append(simplified_layer)
+
+        return SimplifiedChart(layer_sources)
+
+    def clearSimplifiedLayers(self, chart_name):
+        for key in self.simplified_layers.keys():
+            if key[0] == chart_name:
+                self.simplified_layers.pop(key)
+
+    def setUseCompiledCharts(self, use_compiled_charts):
+        self.use_compiled_charts = use_compiled_charts
+
+    def compileCharts(self, chart_names=None, force=False):
+        """
+        Converts the drawn layers of each chart into a GeoPackage in compiled_dir, skipping charts that are already up to date
+
+        Layers added to layer_colors later aren't in the compiled charts, so those charts render from S-57 until they get
+        compiled again, which this does for them even without force
+        """
+        if chart_names is None:
+            chart_names = list(self.files.keys())
+
+        os.makedirs(self.compiled_dir, exist_ok=True)
+        layer_names = list(self.layer_colors.keys())
+
+        for chart_name in chart_names:
+            chart_info = self.files[chart_name]
+            compiled_path = getCompiledPath(self.compiled_dir, chart_name)
+            if not force and isCompiledChartFresh(chart_info.path, compiled_path) and self.isCompiledChartUsable(chart_name):
+                continue
+
+            self.open_charts.pop(("compiled", chart_name))
+            self.compiled_layers.pop(chart_name, None)
+            self.clearSimplifiedLayers(chart_name)
+            try:
+                chart_layers = [name for name in layer_names if name in chart_info.layers]
+                compileChart(chart_info.path, compiled_path, chart_layers)
+                self.compiled_charts[chart_name] = compiled_path
+                self.compiled_layers[chart_name] = set(chart_layers)
+            except Exception as e:
+                print(f"Could not compile chart {chart_name}: {e}")
+                self.compiled_charts.pop(chart_name, None)
+
     def enableTifReproject(self, tif_projection: str, file_name: str = "test.tif"):
+        # Charts get rasterized straight into tif_projection now, file_name is only kept so old calls still work
         self.tif_reproject = True
         self.tif_name = file_name
         self.tif_projection = tif_projection
 
+    def getOutputGrid(self, lower_left, upper_right, width_px, height_px, projection=None):
+        """With tif_reproject, renders without a projection go on a tif_projection grid that keeps the box's aspect ratio"""
+        if projection is not None or not self.tif_reproject:
+            return None
+
+        bounds = [lower_left[1], upper_right[1], lower_left[0], upper_right[0]]
+        raster_bounds = transformBounds(getProjectionWkt("EPSG:4326"), self.tif_projection, bounds)
+        return self.tif_projection, getHeightForBounds(raster_bounds, width_px)
+
+    def getRenderConfig(self):
+        return {"class": type(self).__name__,
+                "catalog_version": self.catalog_version,
+                "color_palette": self.color_palette,
+                "layer_colors": list(self.layer_colors.items()),
+                "shallow_water_depth": self.shallow_water_depth,
+                "scale_aware_selection": self.scale_aware_selection,
+                "simplify_geometry": self.simplify_geometry,
+                "tif_projection": self.tif_projection if self.tif_reproject else None}
+
     def getNeededCharts(self, lower_left, upper_right):
-        chart_list = []
-        p1 = Polygon([(lower_left[1], lower_left[0]), (lower_left[1], upper_right[0]), (upper_right[1], upper_right[0]), (upper_right[1], lower_left[0])])
+        return self.coverage_index.query(lower_left, upper_right)
 
-        for file in self.files:
-            coverage = self.files[file].coverage
-            for polygon in coverage:
-                p2 = Polygon(polygon)
-                if p1.intersects(p2):
-                    if file not in chart_list:
-                        chart_list.append(file)
+    def selectChartsForScale(self, lower_left, upper_right, width_px):
+        """
+        Picks the charts to draw for a render width_px wide, in draw order
 
-        return chart_list
+        Charts of the usage band meant for the display scale are preferred, then coarser ones, and more detailed charts
+        only fill areas nothing else covers. Charts are skipped if better charts already cover their part of the box,
+        or if they would be smaller than a pixel. The best chart for each area comes last, so it draws on top.
+        """
 
-    def plotChart(self, lower_left, upper_right, width_px, height_px):
         bounds = [lower_left[1], upper_right[1], lower_left[0], upper_right[0]]
-        raster_image = createRasterImage(bounds, width_px, height_px)
-        chart_list = self.getNeededCharts(lower_left, upper_right)  # Only rasterize the charts we need
+        meters_per_pixel = boxDimensions(bounds)[0] / width_px
+        pixel_size_x = (bounds[1] - bounds[0]) / width_px
+        pixel_size_y = meters_per_pixel / METERS_PER_DEGREE_LATITUDE
+        display_scale = meters_per_pixel / DISPLAY_PIXEL_SIZE_M
+        target_band = min(band for band in USAGE_BAND_MIN_SCALE if display_scale >= USAGE_BAND_MIN_SCALE[band])
+
+        def preference(chart_name):
+            band = self.files[chart_name].usage_band or target_band
+            if band <= target_band:
+                return 0, -band
+            return 1, band
+
+        candidates = []
+        for chart_name in self.getNeededCharts(lower_left, upper_right):
+            chart_bounds = self.files[chart_name].bounds
+            if len(chart_bounds) == 4 and chart_bounds[1] - chart_bounds[0] < pixel_size_x and chart_bounds[3] - chart_bounds[2] < pixel_size_y:
+                continue  # Sub-pixel
+            candidates.append(chart_name)
+        candidates.sort(key=preference)
+
+        query_box = box(bounds[0], bounds[2], bounds[1], bounds[3])
+        min_new_area = pixel_size_x * pixel_size_y
+        covered = None
+        selected = []
+
+        for chart_name in candidates:
+            visible = self.coverage_index.getCoverage(chart_name).intersection(query_box)
+            new_area = visible.area if covered is None else visible.difference(covered).area
+            if new_area < min_new_area:
+                continue
+
+            selected.append(chart_name)
+            covered = visible if covered is None else covered.union(visible)
+
+        selected.reverse()
+        return selected
+
+    def plotChart(self, lower_left, upper_right, width_px, height_px, projection=None, out=None):
+        image, image_bounds = self.plotChartWithBounds(lower_left, upper_right, width_px, height_px, projection, out)
+        return image
+
+    def plotChartWithBounds(self, lower_left, upper_right, width_px, height_px, projection=None, out=None):
+        """
+        Plots chart based on lat-lon coordinates, and returns the image along with its [lower_left, upper_right] bounds
+
+        If projection is given (anything osr.SetFromUserInput understands, e.g. "EPSG:3857"), the charts get rasterized
+        straight onto a width_px x height_px grid in that projection covering the lat-lon box, and bounds are [x, y] in it.
+        enableTifReproject does the same, but keeps pixels square. Otherwise bounds are [lon, lat].
+
+        If out is given (a uint8 height x width x 3 array), the charts are rasterized straight into it instead of a new array.
+        """
+
+        profiler = self.profiler
+        with profiler.render(type(self).__name__, lower_left, upper_right, width_px, height_px):
+            with profiler.stage("select_charts"):
+                plan = self.planRender(lower_left, upper_right, width_px, height_px, projection)
+            profiler.recordCharts(plan.chart_list)
+
+            if out is None:
+                profiler.recordAllocation(plan.width_px * plan.height_px * 3)
+            out = getImageBuffer(out, plan.height_px, plan.width_px)
+
+            if self.layer_mask_cache is not None:
+                with profiler.stage("composite_masks"):
+                    cv2_image = self.compositeLayerMasks(plan, out)
+            elif self.indexed_rendering:
+                classes = self.rasterizeClasses(plan)
+                with profiler.stage("colorize"):
+                    cv2_image = colorizeClasses(classes, self.getClassPalette(), out)
+            else:
+                out.fill(0)
+                raster_image = plan.wrapImage(out)
 
-        # Set raster image to have the same projection as the origional chart
+                # Go through each chart and its data to the raster image
+                for file in plan.chart_list:
+                    with profiler.stage("open_charts"):
+                        chart = self.getChartForResolution(file, plan.meters_per_pixel)
+                    self.parseSingleChart(chart, raster_image, plan.filter_bounds)
 
-        chart_coordinate_system = self.files[chart_list[0]].chartData.GetLayer(1).GetSpatialRef()
-        raster_image.SetProjection(chart_coordinate_system.ExportToWkt())
+                raster_image = None
+                cv2_image = out
 
-        # Go through each chart and its data to the raster image
-        for file in chart_list:
-            chart = self.files[file].chartData
-            self.parseSingleChart(chart, raster_image)
+        if plan.projection is not None and plan.projection == self.tif_projection:
+            self.tif_bounds = plan.getImageBounds()  # Kept for older callers, plotChartWithBounds is safe with concurrent renders
+
+        return cv2_image, plan.getImageBounds()
+
+    def plotChartWithAlpha(self, lower_left, upper_right, width_px, height_px, projection=None, out=None):
+        """Image and alpha mask, where pixels no chart layer was drawn on are transparent"""
+        with self.profiler.render(type(self).__name__, lower_left, upper_right, width_px, height_px):
+            with self.profiler.stage("select_charts"):
+                plan = self.planRender(lower_left, upper_right, width_px, height_px, projection)
+            self.profiler.recordCharts(plan.chart_list)
 
-        if self.tif_reproject:
-            # This is a hack, but it seems to work
-            # The only way I could get anything to re-project was to save it out as another file type
-            a = gdal.Warp(self.tif_name, raster_image, dstSRS=self.tif_projection)
-            a = None  # Apparently you have to do this to properly free memory
-
-            # https://gis.stackexchange.com/questions/104362/how-to-get-extent-out-of-geotiff
-            test = gdal.Open(self.tif_name)
-            geo_transform = test.GetGeoTransform()
-            min_x = geo_transform[0]
-            max_y = geo_transform[3]
-            max_x = min_x + geo_transform[1] * test.RasterXSize
-            min_y = max_y + geo_transform[5] * test.RasterYSize
-
-            lower_left = [min_x, min_y]
-            upper_right = [max_x, max_y]
-            self.tif_bounds = [lower_left, upper_right]
-            image_channels = test.ReadAsArray()
+            classes = self.rasterizeClasses(plan)
+            with self.profiler.stage("colorize"):
+                image = colorizeClasses(classes, self.getClassPalette(), getImageBuffer(out, plan.height_px, plan.width_px))
+                alpha = (classes != 0).view(numpy.uint8) * numpy.uint8(255)
+
+        return image, alpha
+
+    def plotChartClasses(self, lower_left, upper_right, width_px, height_px, projection=None):
+        """
+        Plots chart as a single band raster of layer class IDs, see getClassNames and getClassPalette
+
+        Returns (classes, palette, bounds), colorizeClasses(classes, palette) gives the same image as plotChartWithBounds
+        """
+        plan = self.planRender(lower_left, upper_right, width_px, height_px, projection)
+        return self.rasterizeClasses(plan), self.getClassPalette(), plan.getImageBounds()
+
+    def planRender(self, lower_left, upper_right, width_px, height_px, projection=None):
+        """Works out which charts to draw and the raster grid to draw them on"""
+        bounds = [lower_left[1], upper_right[1], lower_left[0], upper_right[0]]
+        # Only rasterize the charts we need
+        if self.scale_aware_selection:
+            chart_list = self.selectChartsForScale(lower_left, upper_right, width_px)
         else:
-            image_channels = raster_image.ReadAsArray()
+            chart_list = self.getNeededCharts(lower_left, upper_right)
+
+        # Charts that can't be opened are left out, so one bad file doesn't fail every render that touches it
+        readable_charts = []
+        chart_coordinate_system = None
+        for chart_name in chart_list:
+            try:
+                source = self.getRenderSource(chart_name)
+            except Exception as e:
+                print(e)
+                continue
+
+            readable_charts.append(chart_name)
+            if chart_coordinate_system is None:  # Charts get read in their own coordinate system
+                chart_coordinate_system = getSpatialReference(source).ExportToWkt()
+        chart_list = readable_charts
+
+        if chart_coordinate_system is None:  # Tiles outside every chart come back empty
+            chart_coordinate_system = getProjectionWkt("EPSG:4326")
 
-        cv2_image = numpy.dstack((image_channels[2], image_channels[1], image_channels[0]))
+        if projection is None and self.tif_reproject:
+            projection = self.tif_projection
+            height_px = None
+
+        if projection is None:
+            raster_bounds = bounds
+            raster_projection = chart_coordinate_system
+            filter_bounds = bounds
+        else:
+            # GDAL reprojects the vectors while rasterizing, so there is no warp or second raster
+            raster_bounds = transformBounds(chart_coordinate_system, projection, bounds)
+            if height_px is None:
+                height_px = getHeightForBounds(raster_bounds, width_px)
+            raster_projection = getProjectionWkt(projection)
+            filter_bounds = transformBounds(projection, chart_coordinate_system, raster_bounds)  # Corners stick out of the lat-lon box
+
+        return RenderPlan(chart_list=chart_list, raster_bounds=list(raster_bounds), width_px=width_px, height_px=height_px,
+                          raster_projection=raster_projection, projection=projection, filter_bounds=filter_bounds,
+                          meters_per_pixel=boxDimensions(bounds)[0] / width_px)
+
+    def getClassNames(self):
+        """Name of every class ID in plotChartClasses output, 0 is the empty background"""
+        return ["BACKGROUND"] + list(self.layer_colors.keys()) + [DEEP_WATER_CLASS]
+
+    def getClassPalette(self):
+        """N x 3 BGR lookup table from class ID to color, built from the current palette and layer colors"""
+        class_names = self.getClassNames()
+        palette = numpy.zeros((len(class_names), 3), dtype=numpy.uint8)
+
+        for class_id, class_name in enumerate(class_names):
+            if class_name == "DEPARE":
+                color = self.color_palette["SHALLOW_WATER"]
+            elif class_name == DEEP_WATER_CLASS:
+                color = self.color_palette["WHITE"]
+            elif self.layer_colors.get(class_name) in self.color_palette:
+                color = self.color_palette[self.layer_colors[class_name]]
+            else:
+                continue
+            palette[class_id] = color[::-1]  # Palette is RGB
+
+        return palette
+
+    def rasterizeClasses(self, plan):
+        """Burns each drawn layer's class ID into one band, in the same order the RGB path draws colors"""
+        class_ids = {class_name: class_id for class_id, class_name in enumerate(self.getClassNames())}
+        raster_image = plan.createRaster(1)
+        self.profiler.recordAllocation(plan.width_px * plan.height_px)
+
+        for file in plan.chart_list:
+            with self.profiler.stage("open_charts"):
+                chart = self.getChartForResolution(file, plan.meters_per_pixel)
+
+            for layer_number in self.getSortedLayerNames(chart):
+                try:
+                    layer = chart.GetLayer(layer_number)
+                    description = layer.GetDescription()
+
+                    with spatialFilter(layer, plan.filter_bounds), self.profiler.layer(layer), self.profiler.stage("rasterize"):
+                        if description == "DEPARE":
+                            depthLayer(layer, raster_image, [class_ids["DEPARE"]], [class_ids[DEEP_WATER_CLASS]], self.shallow_water_depth, bands=[1])
+                        elif self.layer_colors[description] in self.color_palette:
+                            singleColor(layer, raster_image, [class_ids[description]], bands=[1])
+                except Exception as e:
+                    print(e)
+
+        classes = raster_image.GetRasterBand(1).ReadAsArray()
+        raster_image = None
+        return classes
+
+    def plotNavigabilityGrid(self, lower_left, upper_right, width_px, height_px, projection=None):
+        """
+        Rasterizes the charts into a NavigabilityGrid of land, shallow, obstruction and navigable cells
+
+        Doesn't depend on the palette or layer colors. Water is shallow where DRVAL1 is at most shallow_water_depth, and
+        cells no chart says anything about are uncharted. Charts are never simplified here, and shallow water, obstructions
+        and land mark every cell they touch, so small hazards can't fall between cell centers and show up as navigable.
+        """
+        plan = self.planRender(lower_left, upper_right, width_px, height_px, projection)
+        raster_image = plan.createRaster(1)
+        raster_image.GetRasterBand(1).Fill(navigability_grid.UNCHARTED)
+
+        shallow_filter, deep_filter = getDepthFilters(self.shallow_water_depth)
+
+        # Deep water from every chart goes down first, so shallow water and hazards from any chart win the cells along its edges
+        for deep_pass in [True, False]:
+            for file in plan.chart_list:
+                try:
+                    chart = self.getRenderSource(file)
+                except Exception as e:
+                    print(e)
+                    continue
+
+                for layer_name, navigability_class in NAVIGABILITY_LAYER_CLASSES.items():
+                    if layer_name not in self.files[file].layers or (deep_pass and navigability_class is not None):
+                        continue
+
+                    try:
+                        layer = self.getNavigabilityLayer(file, chart, layer_name)
+                        with spatialFilter(layer, plan.filter_bounds):
+                            if navigability_class is not None:
+                                singleColor(layer, raster_image, [navigability_class], bands=[1], options=ALL_TOUCHED)
+                            elif layer.GetLayerDefn().GetFieldIndex(MIN_DEPTH_KEY) < 0:
+                                if not deep_pass:  # Without depths there's no telling the area is deep enough
+                                    singleColor(layer, raster_image, [navigability_grid.SHALLOW], bands=[1], options=ALL_TOUCHED)
+                            elif deep_pass:
+                                with attributeFilter(layer, deep_filter):
+                                    singleColor(layer, raster_image, [navigability_grid.NAVIGABLE], bands=[1])
+                            else:
+                                with attributeFilter(layer, shallow_filter):
+                                    singleColor(layer, raster_image, [navigability_grid.SHALLOW], bands=[1], options=ALL_TOUCHED)
+                    except Exception as e:
+                        print(e)
+
+        classes = raster_image.GetRasterBand(1).ReadAsArray()
         raster_image = None
+        return NavigabilityGrid(classes, plan.raster_bounds, plan.raster_projection)
+
+    def getNavigabilityLayer(self, file, chart, layer_name) -> ogr.Layer:
+        """
+        Layer to burn into a navigability grid from chart, the render source for file
+
+        Compiled charts leave out layers that aren't drawn, and older ones have depth areas without DRVAL1, so those come
+        from the S-57 chart instead.
+        """
+        layer = chart.GetLayerByName(layer_name)
+        if layer is not None and (NAVIGABILITY_LAYER_CLASSES[layer_name] is not None or layer.GetLayerDefn().GetFieldIndex(MIN_DEPTH_KEY) >= 0):
+            return layer
+
+        chart_layer = self.getChartData(file).GetLayerByName(layer_name)
+        return chart_layer if chart_layer is not None else layer
+
+    def setProfiler(self, profiler):
+        """Reports stage, layer and chart timings of every render to profiler, None turns profiling back off"""
+        self.profiler = profiler if profiler is not None else NULL_PROFILER
+
+    def setIndexedRendering(self, indexed_rendering):
+        """Rasterizes layer class IDs into one band and colors them with a lookup table, instead of burning 3 bands per layer"""
+        self.indexed_rendering = indexed_rendering
+
+    def compositeLayerMasks(self, plan, out=None):
+        """
+        Builds the image from cached per chart, per layer coverage masks of this tile, rasterizing only the masks it's missing
+
+        A palette change only recolors, toggling a layer only recomposites, and a new shallow water depth only re-rasterizes DEPARE
+        """
+        width_px, height_px = plan.width_px, plan.height_px
+        tile_key = (tuple(plan.raster_bounds), width_px, height_px, plan.raster_projection, tuple(plan.chart_list), self.simplify_geometry)
+        tile_masks = self.layer_mask_cache.getOrCreate(tile_key, dict)
+        mask_raster = None
+
+        cv2_image = getImageBuffer(out, height_px, width_px)
+        cv2_image.fill(0)
+
+        for file in plan.chart_list:
+            chart_layers = self.files[file].layers
+
+            for layer_name in self.layer_colors:
+                if layer_name not in chart_layers:
+                    continue
+
+                if layer_name == "DEPARE":
+                    colors = [self.color_palette["SHALLOW_WATER"], self.color_palette["WHITE"]]
+                    depth_cutoff = self.shallow_water_depth
+                elif self.layer_colors[layer_name] in self.color_palette:
+                    colors = [self.color_palette[self.layer_colors[layer_name]]]
+                    depth_cutoff = None
+                else:
+                    continue
+
+                mask_key = (file, layer_name)
+                if mask_key not in tile_masks or tile_masks[mask_key][0] != depth_cutoff:
+                    if mask_raster is None:
+                        mask_raster = plan.createRaster(1)
+
+                    try:
+                        layer = self.getChartForResolution(file, plan.meters_per_pixel).GetLayerByName(layer_name)
+                        tile_masks[mask_key] = (depth_cutoff, rasterizeLayerMasks(layer, mask_raster, plan.filter_bounds, depth_cutoff))
+                    except Exception as e:
+                        print(e)
+                        continue
+
+                for color, packed_mask in zip(colors, tile_masks[mask_key][1]):
+                    if packed_mask is not None:
+                        mask = numpy.unpackbits(packed_mask, count=width_px * height_px).reshape(height_px, width_px).view(bool)
+                        cv2_image[mask] = color[::-1]  # Palette is RGB
 
         return cv2_image
 
-    def plotWholeChart(self, chart_names, width_px):
-        charts_to_use = {}
+    def enableLayerMaskCache(self, max_tiles=64):
+        """Keeps per-layer masks of the last max_tiles tiles, so palette and layer changes don't touch the charts again"""
+        self.layer_mask_cache = LRUCache(max_tiles)
+
+    def disableLayerMaskCache(self):
+        self.layer_mask_cache = None
+
+    def plotWholeChart(self, chart_names, width_px, out=None):
         for name in chart_names:
-            if name in self.files:
-                charts_to_use[name] = self.files[name].chartData
-            else:
+            if name not in self.files:
                 return
 
-        bounds = getBoundsOverMultipleCharts(charts_to_use.values())
-        raster_image = createRasterImageByWidth(bounds, width_px)
+        bounds = mergeBounds([self.files[name].bounds for name in chart_names])
+        cv2_image = getImageBuffer(out, getImageHeightFromWidth(bounds, width_px), width_px)
+        cv2_image.fill(0)
+        raster_image = wrapImageBuffer(cv2_image, bounds)
 
-        for file in charts_to_use:
-            self.parseSingleChart(charts_to_use[file], raster_image)
+        for name in chart_names:
+            try:
+                chart = self.getRenderSource(name)
+            except Exception as e:
+                print(e)
+                continue
+            self.parseSingleChart(chart, raster_image)
 
-        image_channels = raster_image.ReadAsArray()
-        cv2_image = numpy.dstack((image_channels[2], image_channels[1], image_channels[0]))
         raster_image = None
-
         return cv2_image
 
     def getShapesFromLayers(self, lower_left, upper_right, layers):
-        data = self.getFeaturesForChartsInBounds(lower_left, upper_right, layer_types=layers)
         output = {}
 
-        for layer in data:
-            for feature in data[layer]:
-                if layer not in output:
-                    output[layer] = []
+        for layer_name, chart_name, feature in self.iterFeaturesInBounds(lower_left, upper_right, layer_types=layers):
+            if layer_name not in output:
+                output[layer_name] = []
 
-                output[layer].append(getFeatureInfo(feature))
+            output[layer_name].append(getFeatureInfo(feature))
 
         return output
 
+    def iterFeaturesInBounds(self, lower_left, upper_right, layer_types=None, dedupe=True):
+        """
+        Yields (layer_name, chart_name, feature) for every feature touching the lat-lon box, one feature at a time
+
+        Charts are read through their own handles, taken out of a small pool while the generator reads them, so renders and
+        other generators can run while one is open. With dedupe, features in areas covered by more than one chart only come
+        from the most detailed of them (see getSharedAreas), which drops the copies from overlapping charts without
+        remembering anything about the features already yielded. Features reaching out of the shared area are always kept.
+        """
+        if layer_types is not None and isinstance(layer_types, str):
+            layer_types = [layer_types]
+
+        bounds = [lower_left[1], upper_right[1], lower_left[0], upper_right[0]]
+        chart_list = self.getNeededCharts(lower_left, upper_right)
+        shared_areas = self.getSharedAreas(chart_list) if dedupe else {}
+
+        for chart_name in chart_list:
+            chart = self.query_charts.pop(chart_name)
+            if chart is None:
+                chart = ogr.Open(self.files[chart_name].path)
+            if chart is None:
+                print(f"Could not open chart {chart_name}")
+                continue
+
+            shared_area = shared_areas.get(chart_name)
+
+            try:
+                for i in range(chart.GetLayerCount()):
+                    layer = chart.GetLayerByIndex(i)
+                    layer_name = layer.GetDescription()
+
+                    if layer_types is not None and layer_name not in layer_types:
+                        continue
+
+                    with spatialFilter(layer, bounds):
+                        for feature in iterLayerFeatures(layer):
+                            if shared_area is None or not isInSharedArea(feature, shared_area):
+                                yield layer_name, chart_name, feature
+            finally:
+                self.query_charts.put(chart_name, chart)
+
+    def queryDepths(self, latitudes, longitudes):
+        """
+        Charted depth at arrays of lat-lon points, returns a DepthQuery of per point arrays
+
+        Each point gets the DEPARE DRVAL1/DRVAL2 and the nearest sounding from the most detailed chart that covers it.
+        Charts are indexed the first time a query touches them, see getDepthIndex.
+        """
+        latitudes = numpy.asarray(latitudes, dtype=float).ravel()
+        longitudes = numpy.asarray(longitudes, dtype=float).ravel()
+        result = DepthQuery(drval1=numpy.full(len(latitudes), numpy.nan), drval2=numpy.full(len(latitudes), numpy.nan),
+                            sounding_depth=numpy.full(len(latitudes), numpy.nan), sounding_distance_m=numpy.full(len(latitudes), numpy.nan))
+        if len(latitudes) == 0:
+            return result
+
+        chart_list = self.getNeededCharts([latitudes.min(), longitudes.min()], [latitudes.max(), longitudes.max()])
+        chart_list.sort(key=lambda chart_name: self.files[chart_name].usage_band)  # More detailed charts overwrite the rest
+
+        for chart_name in chart_list:
+            inside = numpy.flatnonzero(contains_xy(self.coverage_index.getCoverage(chart_name), longitudes, latitudes))
+            if len(inside) == 0:
+                continue
+
+            try:
+                depth_index = self.getDepthIndex(chart_name)
+            except Exception as e:
+                print(e)
+                continue
+            point_latitudes, point_longitudes = latitudes[inside], longitudes[inside]
+
+            drval1, drval2 = depth_index.queryDepthAreas(point_latitudes, point_longitudes)
+            found = ~numpy.isnan(drval1) | ~numpy.isnan(drval2)
+            result.drval1[inside[found]] = drval1[found]
+            result.drval2[inside[found]] = drval2[found]
+
+            sounding_depth, sounding_distance = depth_index.queryNearestSoundings(point_latitudes, point_longitudes)
+            found = ~numpy.isnan(sounding_distance)
+            result.sounding_depth[inside[found]] = sounding_depth[found]
+            result.sounding_distance_m[inside[found]] = sounding_distance[found]
+
+        return result
+
+    def getDepthIndex(self, chart_name) -> ChartDepthIndex:
+        return self.depth_indexes.getOrCreate(chart_name, lambda: buildChartDepthIndex(self.getChartData(chart_name)))
+
+    def buildDepthIndexes(self, chart_names=None):
+        """Indexes charts for queryDepths ahead of time, instead of on the first query that needs them"""
+        chart_names = chart_names if chart_names is not None else self.dataSourceNames
+        self.depth_indexes.resize(max(self.depth_indexes.max_size, len(chart_names)))
+
+        for chart_name in chart_names:
+            try:
+                self.getDepthIndex(chart_name)
+            except Exception as e:
+                print(f"Could not index depths of chart {chart_name}: {e}")
+
+    def getSharedAreas(self, chart_list):
+        """
+        For each chart, the part of its coverage it shares with a more detailed chart, None if it doesn't share any
+
+        More detailed means a higher usage band, then earlier in chart_list. Features that lie entirely in a chart's shared
+        area belong to the other chart. Whole coverages are compared, not just the part in the query box, since a
+        feature touching the box can reach far outside it.
+        """
+        ranking = sorted(range(len(chart_list)), key=lambda i: (-self.files[chart_list[i]].usage_band, i))
+
+        shared_areas = {}
+        better_coverage = None
+        for i in ranking:
+            chart_name = chart_list[i]
+            coverage = self.coverage_index.getCoverage(chart_name)
+
+            shared_area = None if better_coverage is None else coverage.intersection(better_coverage)
+            if shared_area is not None and not shared_area.is_empty:
+                prepare(shared_area)
+                shared_areas[chart_name] = shared_area
+            else:
+                shared_areas[chart_name] = None
+
+            better_coverage = coverage if better_coverage is None else better_coverage.union(coverage)
+
+        return shared_areas
+
+    def writeGeoJSONSeq(self, file_handle, lower_left, upper_right, layer_types=None, dedupe=True):
+        """
+        Writes the features in the lat-lon box to a text file handle as newline delimited GeoJSON, returns how many it wrote
+
+        Each feature gets "layer" and "chart" properties. Features are written as they are read, so memory use doesn't grow
+        with the size of the output.
+        """
+        count = 0
+
+        for layer_name, chart_name, feature in self.iterFeaturesInBounds(lower_left, upper_right, layer_types, dedupe):
+            feature_json = feature.ExportToJson(as_object=True)
+            feature_json["properties"]["layer"] = layer_name
+            feature_json["properties"]["chart"] = chart_name
+            file_handle.write(json.dumps(feature_json))
+            file_handle.write("\n")
+            count += 1
+
+        return count
+
     def getFeaturesForChartsInBounds(self, lower_left, upper_right, layer_types=None):
         if layer_types is not None and isinstance(layer_types, str):
             layer_types = [layer_types]
@@ -218,8 +873,14 @@ class NOAALayer(LayerCore):
         chart_list = self.getNeededCharts(lower_left, upper_right)
         output_data = {}
 
+        bounds = [lower_left[1], upper_right[1], lower_left[0], upper_right[0]]
+
         for file in chart_list:
-            chart = self.files[file].chartData
+            try:
+                chart = self.getChartData(file)
+            except Exception as e:
+                print(e)
+                continue
 
             for i in range(chart.GetLayerCount()):
                 layer = chart.GetLayerByIndex(i)
@@ -228,7 +889,8 @@ class NOAALayer(LayerCore):
                 if layer_types is not None and layer_name not in layer_types:
                     continue
 
-                features = getAllFeaturesForLayer(layer)
+                with spatialFilter(layer, bounds):
+                    features = getAllFeaturesForLayer(layer)
 
                 if layer_name not in output_data:
                     output_data[layer_name] = []
@@ -238,54 +900,31 @@ class NOAALayer(LayerCore):
         return output_data
 
     def getDataRegion(self, file):
-        data_set = self.files[file].chartData
-        coverage_layer_index = -1
-        coverage_list = []
-
-        for coverage_layer_index in range(data_set.GetLayerCount()):
-            layer = data_set.GetLayerByIndex(coverage_layer_index)
-            if layer.GetDescription() == "M_COVR":
-                break
-
-        layer = data_set.GetLayerByIndex(coverage_layer_index)
-        nfeat = layer.GetFeatureCount()
-        for j in range(nfeat):  # The last feature is the full rectangle bounding box
-            points_list = []
-
-            feat = layer.GetNextFeature()
-            geom = feat.GetGeometryRef()
-            ring = geom.GetGeometryRef(0)
-            points = ring.GetPointCount()
-            for p in range(points):
-                lon, lat, z = ring.GetPoint(p)
-                points_list.append((lon, lat))
-
-            coverage_list.append(points_list)
-
-        return coverage_list
-
-    def parseSingleChart(self, file, raster_image):
-        # Make a copy of the file so we can modify stuff
-        vector_source = ogr.GetDriverByName("Memory").CopyDataSource(file, "")
+        return self.files[file].coverage
 
+    def parseSingleChart(self, file, raster_image, bounds=None):
+        # Layers are rasterized straight from the chart, nothing here may modify it
+        # If bounds are given, only the features inside them get rasterized
         sorted_layers = self.getSortedLayerNames(file)
 
         for layerNumber in sorted_layers:
             try:
-                layer = vector_source.GetLayer(layerNumber)
-                self.rasterizeSingleLayer(layer, raster_image)
+                layer = file.GetLayer(layerNumber)
+                with spatialFilter(layer, bounds), self.profiler.layer(layer), self.profiler.stage("rasterize"):
+                    self.rasterizeSingleLayer(layer, raster_image)
             except Exception as e:
                 print(e)
 
     def rasterizeSingleLayer(self, layer: ogr.Layer, raster_image: gdal.Dataset):
+        # raster_image is a wrapped BGR image buffer, the palette is RGB
         description = layer.GetDescription()
 
         if description == "DEPARE":
-            depthLayer(layer, raster_image, self.color_palette["SHALLOW_WATER"], self.color_palette["WHITE"], self.shallow_water_depth)
+            depthLayer(layer, raster_image, self.color_palette["SHALLOW_WATER"], self.color_palette["WHITE"], self.shallow_water_depth, bands=BGR_BANDS)
         elif description in self.layer_colors:
             color_choice = self.layer_colors[description]
             if color_choice in self.color_palette:
-                singleColor(layer, raster_image, self.color_palette[color_choice])
+                singleColor(layer, raster_image, self.color_palette[color_choice], bands=BGR_BANDS)
 
     def getSortedLayerNames(self, file: ogr.DataSource):
         # Coverage: M_COVR
@@ -305,22 +944,9 @@ class NOAALayer(LayerCore):
         return out_list
 
 
-def getFileBounds(file_data):
-    bounds = []
-
-    for i in range(file_data.GetLayerCount()):
-        layer = file_data.GetLayer(i)
-        x_min, x_max, y_min, y_max = layer.GetExtent()
-        if abs(x_min - x_max) > 0.000001 and abs(y_min - y_max) > 0.000001:  # Some layers are very small, so we don't care about them
-            if len(bounds) == 0:
-                bounds = [x_min, x_max, y_min, y_max]
-            else:
-                bounds[0] = min(bounds[0], x_min)
-                bounds[1] = max(bounds[1], x_max)
-                bounds[2] = min(bounds[2], y_min)
-                bounds[3] = max(bounds[3], y_max)
-
-    return bounds
+def getSimplifiedLayerSize(entry):
+    simplified_layer, size_bytes = entry
+    return size_bytes
 
 
 def createRasterImageByWidth(bounds, width_px):
@@ -328,25 +954,74 @@ def createRasterImageByWidth(bounds, width_px):
     return createRasterImage(bounds, width_px, height_px)
 
 
-def createRasterImage(bounds, width_px, height_px) -> osgeo.gdal.Dataset:
+def createRasterImage(bounds, width_px, height_px, bands=3) -> osgeo.gdal.Dataset:
+    driver = gdal.GetDriverByName('MEM')
+    raster_image = driver.Create("", width_px, height_px, bands, gdal.GDT_Byte)
+    raster_image.SetGeoTransform(getGeoTransform(bounds, width_px, height_px))
+    raster_image.GetRasterBand(1).SetNoDataValue(1000)
+
+    return raster_image
+
+
+def wrapImageBuffer(image, bounds, projection=None) -> osgeo.gdal.Dataset:
+    """
+    GDAL dataset on top of a uint8 height x width x 3 BGR image, without copying it
+
+    The dataset is pixel interleaved like the image, so rasterizing into it with BGR_BANDS draws straight into the image.
+    The image has to outlive the dataset.
+    """
+    raster_image = gdal_array.OpenArray(image, interleave="pixel")
+    if raster_image is None:
+        raise Exception("could not wrap image buffer: %s %s" % (image.dtype, image.shape))
+
+    raster_image.SetGeoTransform(getGeoTransform(bounds, image.shape[1], image.shape[0]))
+    if projection is not None:
+        raster_image.SetProjection(projection)
+    return raster_image
+
+
+def getHeightForBounds(bounds, width_px):
+    """Image height that gives [x_min, x_max, y_min, y_max] square pixels at width_px"""
+    return max(1, int(round(width_px * (bounds[3] - bounds[2]) / (bounds[1] - bounds[0]))))
+
+
+def getGeoTransform(bounds, width_px, height_px):
+    """North up geotransform of a width_px x height_px grid over [x_min, x_max, y_min, y_max]"""
     [longitude_min, longitude_max, latitude_min, latitude_max] = bounds
     pixel_size_x = (longitude_max - longitude_min) / width_px  # Figure out pixel size in lat and lon
     pixel_size_y = (latitude_max - latitude_min) / height_px
+    return longitude_min, pixel_size_x, 0, latitude_max, 0, -pixel_size_y
 
-    driver = gdal.GetDriverByName('MEM')
-    raster_image = driver.Create("", width_px, height_px, 3, gdal.GDT_Byte)
-    raster_image.SetGeoTransform((longitude_min, pixel_size_x, 0, latitude_max, 0, -pixel_size_y))
-    raster_image.GetRasterBand(1).SetNoDataValue(1000)
 
-    return raster_image
+def openDataSource(path) -> ogr.DataSource:
+    """Opens a chart or compiled chart, raising instead of returning None so a failed open never lands in a handle pool"""
+    data_source = ogr.Open(path)
+    if data_source is None:
+        raise Exception("could not open chart: %s" % path)
 
+    return data_source
 
-def getBoundsOverMultipleCharts(file_data):
+
+def getSpatialReference(file: ogr.DataSource) -> osr.SpatialReference:
+    """Coordinate system of the first layer that has one (the S-57 DSID layer doesn't)"""
+    for i in range(file.GetLayerCount()):
+        spatial_reference = file.GetLayerByIndex(i).GetSpatialRef()
+        if spatial_reference is not None:
+            return spatial_reference
+
+    spatial_reference = osr.SpatialReference()
+    spatial_reference.ImportFromEPSG(4326)
+    return spatial_reference
+
+
+def mergeBounds(bounds_list):
     bounds = []
 
-    for file in file_data:
-        [x_min, x_max, y_min, y_max] = getFileBounds(file)
+    for chart_bounds in bounds_list:
+        if len(chart_bounds) != 4:  # Charts without any real geometry
+            continue
 
+        [x_min, x_max, y_min, y_max] = chart_bounds
         if len(bounds) == 0:
             bounds = [x_min, x_max, y_min, y_max]
         else:
@@ -358,54 +1033,138 @@ def getBoundsOverMultipleCharts(file_data):
     return bounds
 
 
+def getBoundsOverMultipleCharts(file_data):
+    return mergeBounds([getFileBounds(file) for file in file_data])
+
+
 """NOAA LAYER CONVERSIONS"""
 
 RASTERIZE_COLOR_FIELD = "__color__"
 MIN_DEPTH_KEY = "DRVAL1"
 MAX_DEPTH_KEY = "DRVAL2"
+ALL_TOUCHED = ["ALL_TOUCHED=TRUE"]  # Rasterize option that burns every pixel a feature touches, not just the ones whose center it covers
 
 
-def singleColor(layer, raster_image, color):
+def singleColor(layer, raster_image, color, bands=(1, 2, 3), options=None):
     # Rasterize
-    err = gdal.RasterizeLayer(raster_image, (1, 2, 3), layer, burn_values=color)
+    err = gdal.RasterizeLayer(raster_image, bands, layer, burn_values=color, options=options or [])
     if err != 0:
         raise Exception("error rasterizing layer: %s" % err)
 
 
-def depthLayer(layer: ogr.Layer, raster_image: gdal.Dataset, shallow_color, deep_color, depth_cutoff):
+def depthLayer(layer: ogr.Layer, raster_image: gdal.Dataset, shallow_color, deep_color, depth_cutoff, bands=(1, 2, 3)):
     # TODO: Scale depth cutoff
 
-    # Make temp place to store deep water areas, so we can rasterize them white
-    source = ogr.GetDriverByName('MEMORY').CreateDataSource('memData')
-    deep_layer = source.CreateLayer("DEEP", layer.GetSpatialRef())
+    # Split shallow and deep areas with attribute filters instead of copying the layer. Depths are in METERS!
+    # Areas without a minimum depth are drawn as shallow
+    shallow_filter, deep_filter = getDepthFilters(depth_cutoff)
 
-    for i in range(layer.GetFeatureCount()):
-        feature = layer.GetNextFeature()
-        min_depth = float(feature.GetField(MIN_DEPTH_KEY))  # Depths are in METERS!
-
-        if min_depth > depth_cutoff:
-            deep_layer.SetFeature(feature)
-            layer.DeleteFeature(feature.GetFID())
+    try:
+        layer.SetAttributeFilter(shallow_filter)
+        err = gdal.RasterizeLayer(raster_image, bands, layer, burn_values=shallow_color)
+        layer.SetAttributeFilter(deep_filter)
+        err1 = gdal.RasterizeLayer(raster_image, bands, layer, burn_values=deep_color)
+    finally:
+        layer.SetAttributeFilter(None)
 
-    # Rasterize
-    err = gdal.RasterizeLayer(raster_image, (1, 2, 3), layer, burn_values=shallow_color)
-    err1 = gdal.RasterizeLayer(raster_image, (1, 2, 3), deep_layer, burn_values=deep_color)
     if err != 0 or err1 != 0:
         raise Exception("error rasterizing layer: %s" % err)
 
 
+def colorizeClasses(classes, palette, out=None):
+    """OpenCV style image from a class ID raster and an N x 3 BGR palette"""
+    return numpy.take(palette, classes, axis=0, out=out)
+
+
+def rasterizeLayerMasks(layer: ogr.Layer, mask_raster: gdal.Dataset, bounds, depth_cutoff=None):
+    """
+    Bit-packed coverage masks of a layer on mask_raster's grid
+
+    Returns [mask], or [shallow mask, deep mask] if depth_cutoff is given. Masks with nothing in them are None.
+    """
+    if layer is None:
+        return [None] if depth_cutoff is None else [None, None]
+
+    attribute_filters = [None] if depth_cutoff is None else list(getDepthFilters(depth_cutoff))
+    masks = []
+
+    with spatialFilter(layer, bounds):
+        for attribute_filter in attribute_filters:
+            band = mask_raster.GetRasterBand(1)
+            band.Fill(0)
+
+            try:
+                layer.SetAttributeFilter(attribute_filter)
+                err = gdal.RasterizeLayer(mask_raster, [1], layer, burn_values=[1])
+            finally:
+                layer.SetAttributeFilter(None)
+            if err != 0:
+                raise Exception("error rasterizing layer: %s" % err)
+
+            mask = band.ReadAsArray()
+            masks.append(numpy.packbits(mask.astype(bool)) if mask.any() else None)
+
+    return masks
+
+
+def getDepthFilters(depth_cutoff):
+    """OGR SQL attribute filters selecting the shallow and deep DEPARE areas"""
+    cutoff = float(depth_cutoff)
+    shallow_filter = "{0} <= {1!r} OR {0} IS NULL".format(MIN_DEPTH_KEY, cutoff)
+    deep_filter = "{0} > {1!r}".format(MIN_DEPTH_KEY, cutoff)
+    return shallow_filter, deep_filter
+
+
+@contextmanager
+def spatialFilter(layer: ogr.Layer, bounds):
+    """Limits the layer to features touching [lon_min, lon_max, lat_min, lat_max] while inside the with block"""
+    if bounds is None:
+        yield layer
+        return
+
+    [longitude_min, longitude_max, latitude_min, latitude_max] = bounds
+    layer.SetSpatialFilterRect(longitude_min, latitude_min, longitude_max, latitude_max)
+    try:
+        yield layer
+    finally:
+        layer.SetSpatialFilter(None)
+
+
+@contextmanager
+def attributeFilter(layer: ogr.Layer, attribute_filter):
+    """Limits the layer to features matching an OGR SQL filter while inside the with block"""
+    layer.SetAttributeFilter(attribute_filter)
+    try:
+        yield layer
+    finally:
+        layer.SetAttributeFilter(None)
+
+
 def getAllFeaturesForLayer(layer: ogr.Layer):
-    features = []
+    return list(iterLayerFeatures(layer))
+
 
+def iterLayerFeatures(layer: ogr.Layer):
+    """Yields the layer's features (through its current filters) one at a time"""
     try:
-        n_features = layer.GetFeatureCount()
+        # Walk the layer instead of using GetFeatureCount, which has to do a full pass when a filter is set
+        layer.ResetReading()
+        feature = layer.GetNextFeature()
 
-        for j in range(n_features):
-            features.append(layer.GetNextFeature())
+        while feature is not None:
+            yield feature
+            feature = layer.GetNextFeature()
     except Exception as e:
         print(f"Error on layer {layer.GetDescription()} {e}")
 
-    return features
+
+def isInSharedArea(feature: ogr.Feature, shared_area):
+    geometry = feature.GetGeometryRef()
+    if geometry is None:  # Records without geometry belong to every chart
+        return False
+
+    # Only whole features, anything reaching past the more detailed chart still has data only this chart has
+    return contains(shared_area, from_wkb(bytes(geometry.ExportToWkb())))
 
 
 def getFeatureInfo(feature: ogr.Feature):
@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+
+"""
+Basemap layer drawn from local GeoTIFF / Cloud Optimized GeoTIFF files, e.g. USGS topo maps or satellite imagery
+"""
+
+import math
+import os
+from dataclasses import dataclass, field
+
+import numpy
+from osgeo import gdal
+
+from .layer_core import LayerCore
+from chart_plotter.utility.image_buffers import getImageBuffer
+from chart_plotter.utility.lru_cache import LRUCache, countBytes
+from chart_plotter.utility.projections import getCoordinateTransform, getProjectionWkt, transformBounds
+from chart_plotter.utility.spatial_index import CoverageIndex
+
+RASTER_EXTENSIONS = (".tif", ".tiff")
+CONTROL_POINT_SPACING_PX = 16  # Reprojected renders transform every 16th pixel exactly and interpolate the rest
+OVERVIEW_SLACK = 1.01  # Overviews a hair coarser than the render still get used, so rounding doesn't force full resolution reads
+
+
+@dataclass
+class RasterFileInfo(object):
+    name: str
+    path: str
+    projection: str  # WKT
+    geo_transform: tuple  # North up, no rotation
+    band_count: int
+    levels: list = field(default_factory=list)  # (width, height, block_width, block_height) of the full image, then each overview
+    nodata: float = None
+    color_table: numpy.ndarray = None  # 256 x 4 RGBA lookup table for paletted files
+    file_stamp: tuple = None  # (modification time in ns, size in bytes) when the info was read, see getFileStamp
+
+
+class RasterFileLayer(LayerCore):
+    """
+    Draws local GeoTIFFs, reading only the part of each file in view, from the overview level closest to the render scale
+
+    Files are found through a spatial index of their footprints, and raw blocks read from them are kept in an LRU of
+    block_cache_bytes, so panning around only reads the blocks that just came into view. Files later in the list draw on
+    top. Rasters must be north up; 1 band (grey or paletted), 3 band (RGB) and 4 band (RGBA) 8 bit files are supported.
+    A file replaced in place is read again the next time it's drawn, but keeps the footprint it had when the layer was made.
+    """
+
+    def __init__(self, raster_dir=None, file_paths=None, max_open_files=16, block_cache_bytes=128 * 1024 * 1024):
+        super(RasterFileLayer, self).__init__()
+
+        if file_paths is None:
+            file_paths = []
+        else:
+            file_paths = list(file_paths)
+
+        if raster_dir is not None:
+            for root, dirs, files in os.walk(raster_dir):
+                for file in sorted(files):
+                    if file.lower().endswith(RASTER_EXTENSIONS):
+                        file_paths.append(os.path.join(root, file))
+
+        self.open_files = LRUCache(max_open_files)
+        self.block_cache = LRUCache(block_cache_bytes, size_function=countBytes)
+
+        self.files = {}
+        self.generation = 0  # Goes up every time a file is found changed on disk, so the render config changes with it
+        self.coverage_index = CoverageIndex()
+        for path in file_paths:
+            try:
+                file_info = self.readFileInfo(path)
+            except Exception as e:
+                print(f"Could not load raster {path}: {e}")
+                continue
+
+            self.files[file_info.name] = file_info
+            self.dataSourceNames.append(file_info.name)
+
+            [x_min, x_max, y_min, y_max] = transformBounds(file_info.projection, getProjectionWkt("EPSG:4326"), getFileBounds(file_info))
+            self.coverage_index.addItem(file_info.name, [[(x_min, y_min), (x_max, y_min), (x_max, y_max), (x_min, y_max)]])
+
+        self.coverage_index.build()
+
+    def readFileInfo(self, path) -> RasterFileInfo:
+        file_stamp = getFileStamp(path)
+        data_set = gdal.Open(path)
+        if data_set is None:
+            raise Exception("could not open raster: %s" % path)
+
+        geo_transform = data_set.GetGeoTransform()
+        if geo_transform[2] != 0 or geo_transform[4] != 0:
+            raise Exception("rotated rasters aren't supported: %s" % path)
+
+        band = data_set.GetRasterBand(1)
+        levels = [(band.XSize, band.YSize) + tuple(band.GetBlockSize())]
+        for i in range(band.GetOverviewCount()):
+            overview = band.GetOverview(i)
+            levels.append((overview.XSize, overview.YSize) + tuple(overview.GetBlockSize()))
+        levels.sort(key=lambda level: -level[0])
+
+        color_table = None
+        if data_set.RasterCount == 1 and band.GetColorTable() is not None:
+            table = band.GetColorTable()
+            color_table = numpy.zeros((256, 4), dtype=numpy.uint8)
+            for i in range(min(256, table.GetCount())):
+                color_table[i] = table.GetColorEntry(i)
+
+        projection = data_set.GetProjection() or getProjectionWkt("EPSG:4326")
+        name = os.path.splitext(os.path.basename(path))[0]
+        if name in self.files:
+            name = path
+
+        return RasterFileInfo(name=name, path=path, projection=getProjectionWkt(projection), geo_transform=tuple(geo_transform),
+                              band_count=data_set.RasterCount, levels=levels, nodata=band.GetNoDataValue(), color_table=color_table,
+                              file_stamp=file_stamp)
+
+    def getFileInfo(self, name) -> RasterFileInfo:
+        """Info of a file, read again (dropping its open handle) if the file changed since the info was read"""
+        file_info = self.files[name]
+        if getFileStamp(file_info.path) == file_info.file_stamp:
+            return file_info
+
+        self.open_files.pop(file_info.path)
+        file_info = self.readFileInfo(file_info.path)
+        file_info.name = name
+        self.files[name] = file_info
+        self.generation += 1
+        return file_info
+
+    def checkFiles(self):
+        """Reads the info of every file that changed on disk again, for callers that serve cached tiles without rendering"""
+        for name in self.dataSourceNames:
+            try:
+                self.getFileInfo(name)
+            except Exception as e:
+                print(e)
+
+    def getRenderConfig(self):
+        # The generation instead of every file's stamp, so this doesn't stat every file on every tile lookup. Rendered tiles
+        # of a file replaced in place stop being reused once a render or checkFiles notices the change
+        return {"class": type(self).__name__,
+                "data_sources": [self.files[name].path for name in self.dataSourceNames],
+                "generation": self.generation}
+
+    def getNeededFiles(self, lower_left, upper_right):
+        return self.coverage_index.query(lower_left, upper_right)
+
+    def plotChart(self, lower_left, upper_right, width_px, height_px, projection=None, out=None):
+        image, alpha = self.plotChartWithAlpha(lower_left, upper_right, width_px, height_px, projection, out)
+        return image
+
+    def plotChartWithAlpha(self, lower_left, upper_right, width_px, height_px, projection=None, out=None):
+        """Image of the files over a lat-lon box, alpha is 0 where no file has data"""
+        bounds = [lower_left[1], upper_right[1], lower_left[0], upper_right[0]]
+        output_projection = getProjectionWkt(projection if projection is not None else "EPSG:4326")
+        grid_bounds = bounds if projection is None else transformBounds(getProjectionWkt("EPSG:4326"), output_projection, bounds)
+
+        image = getImageBuffer(out, height_px, width_px)
+        image.fill(0)
+        alpha = numpy.zeros((height_px, width_px), dtype=numpy.uint8)
+
+        for name in self.getNeededFiles(lower_left, upper_right):
+            try:
+                self.drawFile(self.getFileInfo(name), grid_bounds, output_projection, image, alpha)
+            except Exception as e:
+                print(e)
+
+        return image, alpha
+
+    def drawFile(self, file_info: RasterFileInfo, grid_bounds, output_projection, image, alpha):
+        height_px, width_px = alpha.shape
+        source_x, source_y = getSourceCoordinates(grid_bounds, width_px, height_px, output_projection, file_info.projection)
+
+        # Pixel coordinates in the full resolution file
+        origin_x, pixel_width, _, origin_y, _, pixel_height = file_info.geo_transform
+        column = (source_x - origin_x) / pixel_width
+        row = (source_y - origin_y) / pixel_height
+
+        level = chooseLevel(file_info, column, row, width_px, height_px)
+        level_width, level_height = file_info.levels[level][0:2]
+        column = column * (level_width / file_info.levels[0][0])
+        row = row * (level_height / file_info.levels[0][1])
+
+        # Nearest neighbour sample of the window the render covers
+        column_inside = (column >= 0) & (column < level_width)
+        row_inside = (row >= 0) & (row < level_height)
+        if column.ndim == 1:  # Same projection, rows and columns are separable
+            inside = row_inside[:, numpy.newaxis] & column_inside[numpy.newaxis, :]
+            if not column_inside.any() or not row_inside.any():
+                return
+            column_range, row_range = column[column_inside], row[row_inside]
+        else:
+            inside = row_inside & column_inside
+            if not inside.any():
+                return
+            column_range, row_range = column[inside], row[inside]
+
+        column_min, column_max = int(column_range.min()), int(column_range.max()) + 1
+        row_min, row_max = int(row_range.min()), int(row_range.max()) + 1
+        window = self.readWindow(file_info, level, column_min, row_min, column_max, row_max)
+
+        column = numpy.clip(column - column_min, 0, column_max - column_min - 1).astype(numpy.int64)
+        row = numpy.clip(row - row_min, 0, row_max - row_min - 1).astype(numpy.int64)
+        if column.ndim == 1:
+            samples = window[:, row[:, numpy.newaxis], column[numpy.newaxis, :]]
+        else:
+            samples = window[:, row, column]
+
+        rgb, valid = toRgb(file_info, samples)
+        valid &= inside
+
+        image[valid] = rgb[valid][:, ::-1]  # Image is BGR
+        alpha[valid] = 255
+
+    def readWindow(self, file_info: RasterFileInfo, level, column_min, row_min, column_max, row_max):
+        """(bands, rows, columns) array of one overview level, put together from cached blocks"""
+        level_width, level_height, block_width, block_height = file_info.levels[level]
+        window = None
+
+        for block_y in range(row_min // block_height, (row_max - 1) // block_height + 1):
+            for block_x in range(column_min // block_width, (column_max - 1) // block_width + 1):
+                block = self.readBlock(file_info, level, block_x, block_y)
+                if window is None:
+                    window = numpy.zeros((file_info.band_count, row_max - row_min, column_max - column_min), dtype=block.dtype)
+
+                # Overlap of the block and the window, in level pixels
+                x0, y0 = max(column_min, block_x * block_width), max(row_min, block_y * block_height)
+                x1, y1 = min(column_max, block_x * block_width + block.shape[2]), min(row_max, block_y * block_height + block.shape[1])
+                window[:, y0 - row_min:y1 - row_min, x0 - column_min:x1 - column_min] = block[:, y0 - block_y * block_height:y1 - block_y * block_height, x0 - block_x * block_width:x1 - block_x * block_width]
+
+        return window
+
+    def readBlock(self, file_info: RasterFileInfo, level, block_x, block_y):
+        key = (file_info.path, file_info.file_stamp, level, block_x, block_y)  # Blocks of an older version of the file just age out
+        block = self.block_cache.get(key)
+        if block is not None:
+            return block
+
+        level_width, level_height, block_width, block_height = file_info.levels[level]
+        x_offset, y_offset = block_x * block_width, block_y * block_height
+        x_size, y_size = min(block_width, level_width - x_offset), min(block_height, level_height - y_offset)
+
+        data_set = self.open_files.getOrCreate(file_info.path, lambda: gdal.Open(file_info.path))
+        bands = []
+        for band_number in range(1, file_info.band_count + 1):
+            band = data_set.GetRasterBand(band_number)
+            if level > 0:
+                band = getOverviewForLevel(band, file_info.levels[level])
+            bands.append(band.ReadAsArray(x_offset, y_offset, x_size, y_size))
+
+        block = numpy.stack(bands)
+        self.block_cache.put(key, block)
+        return block
+
+    def clearBlockCache(self):
+        self.block_cache.clear()
+
+
+def getFileStamp(path):
+    """(modification time in ns, size in bytes) of a file, (None, None) if it's gone"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None, None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def getFileBounds(file_info: RasterFileInfo):
+    origin_x, pixel_width, _, origin_y, _, pixel_height = file_info.geo_transform
+    width, height = file_info.levels[0][0:2]
+    x_values = [origin_x, origin_x + width * pixel_width]
+    y_values = [origin_y, origin_y + height * pixel_height]
+    return [min(x_values), max(x_values), min(y_values), max(y_values)]
+
+
+def getOverviewForLevel(band, level):
+    for i in range(band.GetOverviewCount()):
+        overview = band.GetOverview(i)
+        if (overview.XSize, overview.YSize) == tuple(level[0:2]):
+            return overview
+
+    raise Exception("no overview of size %s" % (level[0:2],))
+
+
+def chooseLevel(file_info: RasterFileInfo, column, row, width_px, height_px):
+    """Coarsest level whose pixels are still at most the size of a render pixel"""
+    if column.ndim == 1:
+        file_pixels_per_px = min(abs(column[-1] - column[0]) / max(1, width_px - 1), abs(row[-1] - row[0]) / max(1, height_px - 1))
+    else:
+        file_pixels_per_px = min(numpy.abs(numpy.diff(column, axis=1)).mean() if width_px > 1 else 1,
+                                 numpy.abs(numpy.diff(row, axis=0)).mean() if height_px > 1 else 1)
+
+    full_width = file_info.levels[0][0]
+    best_level = 0
+    for level, (level_width, level_height, block_width, block_height) in enumerate(file_info.levels):
+        if full_width / level_width <= file_pixels_per_px * OVERVIEW_SLACK:
+            best_level = level
+    return best_level
+
+
+def getSourceCoordinates(grid_bounds, width_px, height_px, output_projection, source_projection):
+    """
+    Coordinates in source_projection of the output pixel centers
+
+    Returns 1D x (per column) and y (per row) arrays when the projections are the same, otherwise height x width arrays made
+    by transforming a sparse grid of control points and interpolating between them.
+    """
+    [x_min, x_max, y_min, y_max] = grid_bounds
+    x_values = x_min + (numpy.arange(width_px) + 0.5) * (x_max - x_min) / width_px
+    y_values = y_max - (numpy.arange(height_px) + 0.5) * (y_max - y_min) / height_px
+
+    if output_projection == source_projection:
+        return x_values, y_values
+
+    control_columns = getControlPoints(width_px)
+    control_rows = getControlPoints(height_px)
+    control_x, control_y = numpy.meshgrid(x_values[control_columns], y_values[control_rows])
+    points = numpy.column_stack((control_x.ravel(), control_y.ravel()))
+    transformed = numpy.array(getCoordinateTransform(output_projection, source_projection).TransformPoints(points))
+
+    column_weights = getInterpolationWeights(width_px, control_columns)
+    row_weights = getInterpolationWeights(height_px, control_rows)
+    source_x = row_weights @ transformed[:, 0].reshape(control_y.shape) @ column_weights.T
+    source_y = row_weights @ transformed[:, 1].reshape(control_y.shape) @ column_weights.T
+    return source_x, source_y
+
+
+def getControlPoints(size_px):
+    count = max(2, int(math.ceil(size_px / CONTROL_POINT_SPACING_PX)) + 1)
+    return numpy.unique(numpy.linspace(0, size_px - 1, count).round().astype(int))
+
+
+def getInterpolationWeights(size_px, control_points):
+    """size_px x len(control_points) matrix that linearly interpolates values at control_points to every pixel"""
+    weights = numpy.zeros((size_px, len(control_points)))
+    if len(control_points) == 1:
+        weights[:, 0] = 1
+        return weights
+
+    pixels = numpy.arange(size_px)
+    upper = numpy.clip(numpy.searchsorted(control_points, pixels, side="right"), 1, len(control_points) - 1)
+    lower = upper - 1
+    fraction = (pixels - control_points[lower]) / (control_points[upper] - control_points[lower])
+    weights[pixels, lower] = 1 - fraction
+    weights[pixels, upper] = fraction
+    return weights
+
+
+def toRgb(file_info: RasterFileInfo, samples):
+    """(..., 3) uint8 RGB and a mask of pixels with data, from (bands, ...) samples"""
+    valid = numpy.ones(samples.shape[1:], dtype=bool)
+    if file_info.nodata is not None:
+        valid &= samples[0] != file_info.nodata
+
+    samples = numpy.clip(samples, 0, 255).astype(numpy.uint8)
+
+    if file_info.color_table is not None:
+        rgba = file_info.color_table[samples[0]]
+        return rgba[..., 0:3], valid & (rgba[..., 3] > 0)
+
+    if file_info.band_count < 3:
+        return numpy.repeat(samples[0][..., numpy.newaxis], 3, axis=-1), valid
+
+    if file_info.band_count >= 4:
+        valid &= samples[3] > 0
+
+    return numpy.moveaxis(samples[0:3], 0, -1), valid
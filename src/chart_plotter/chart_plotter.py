@@ -6,19 +6,43 @@ ChartPlotter
 A configurable system for drawing charts
 """
 
-import navpy
+import hashlib
+import json
+import multiprocessing
+import os
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import numpy
+from osgeo import gdal, osr
 
 from .chart_layers.noaa_layer import NOAALayer
-from .utility.conversions import getImageHeightFromWidth
+from .chart_layers.raster_file_layer import RasterFileLayer
+from .utility.conversions import getImageHeightFromWidth, getImageHeightsFromWidth, upperRightFromSize
+from .utility.image_buffers import ImageBuffer, getImageBuffer
+from .utility.render_profiler import NULL_PROFILER, RenderProfiler
 
 
 class ChartPlotter(object):
-    def __init__(self, noaa_chart_directory=None):
+    def __init__(self, noaa_chart_directory=None, raster_directory=None):
         self.layer_objects = {
             "NOAA": NOAALayer(chart_dir=noaa_chart_directory)
         }
 
+        # Basemap imagery, drawn under the charts with setLayers(["RASTER", "NOAA"])
+        if raster_directory is not None:
+            self.layer_objects["RASTER"] = RasterFileLayer(raster_dir=raster_directory)
+
         self.layers = ["NOAA"]
+        self.profiler = NULL_PROFILER
+        self.layer_executor = None  # Threads for rendering layers side by side, made when more than one layer is on
+
+    def __getstate__(self):
+        # Worker copies don't profile, a RenderProfiler can't be shared between processes
+        state = self.__dict__.copy()
+        state["profiler"] = NULL_PROFILER
+        state["layer_executor"] = None
+        return state
 
     def plotChartPixels(self, lower_left, width, height, pixels_per_meter):
         """
@@ -27,7 +51,7 @@ class ChartPlotter(object):
 
         width_meters = width / pixels_per_meter
         height_meters = height / pixels_per_meter
-        upper_right = navpy.ned2lla((height_meters, width_meters, 0), lower_left[0], lower_left[1], 0)
+        upper_right = upperRightFromSize(lower_left, width_meters, height_meters)[0]
 
         return self.plotChartByWidth(lower_left, [upper_right[0], upper_right[1]], width)
 
@@ -35,12 +59,176 @@ class ChartPlotter(object):
         height_px = getImageHeightFromWidth([lower_left[1], upper_right[1], lower_left[0], upper_right[0]], width_px)
         return self.plotChart(lower_left, upper_right, width_px, height_px)
 
-    def plotChart(self, lower_left, upper_right, width_px, height_px):
-        for layer in self.layers:
-            image = self.layer_objects[layer].plotChart(lower_left, upper_right, width_px, height_px)
+    def plotChart(self, lower_left, upper_right, width_px, height_px, projection=None, out=None):
+        """
+        Plots every layer in self.layers and stacks them in order, the first layer at the bottom
+
+        Layers render at the same time on separate threads (GDAL lets go of the GIL while it rasterizes and reads), then get
+        alpha blended into out, or a new image if out isn't given. Every layer draws on the same grid, so if one of them picks
+        its own (e.g. NOAA with tif_reproject) the rest draw on that one too.
+        """
+        if len(self.layers) == 1:
+            layer = self.layers[0]
+            with self.profiler.render("ChartPlotter", lower_left, upper_right, width_px, height_px), self.profiler.stage(layer):
+                return self.layer_objects[layer].plotChart(lower_left, upper_right, width_px, height_px, projection, out)
+
+        projection, height_px = self.getOutputGrid(lower_left, upper_right, width_px, height_px, projection)
+
+        with self.profiler.render("ChartPlotter", lower_left, upper_right, width_px, height_px):
+            with self.profiler.stage("render_layers"):
+                layer_images = self.renderLayers(lower_left, upper_right, width_px, height_px, projection)
+
+            with self.profiler.stage("composite"):
+                image = None
+                for layer_image, alpha in layer_images:
+                    if layer_image is None:
+                        continue
+                    if image is None:
+                        image = getImageBuffer(out, layer_image.shape[0], layer_image.shape[1])
+                        image.fill(0)
+                    blendLayer(image, layer_image, alpha)
 
         return image
 
+    def getOutputGrid(self, lower_left, upper_right, width_px, height_px, projection=None):
+        """(projection, height_px) for every layer in self.layers to draw on, so their images line up for blending"""
+        grids = set()
+        for layer in self.layers:
+            grid = self.layer_objects[layer].getOutputGrid(lower_left, upper_right, width_px, height_px, projection)
+            if grid is not None:
+                grids.add(grid)
+
+        if len(grids) > 1:
+            raise Exception("layers %s draw on different grids: %s" % (self.layers, sorted(grids)))
+        if len(grids) == 1:
+            return grids.pop()
+
+        return projection, height_px
+
+    def renderLayers(self, lower_left, upper_right, width_px, height_px, projection=None):
+        """(image, alpha) of each layer in self.layers, all but the first rendered on the layer threads"""
+        layer_objects = [self.layer_objects[layer] for layer in self.layers]
+        if len(layer_objects) == 0:
+            return []
+
+        if self.layer_executor is None:
+            self.layer_executor = ThreadPoolExecutor(max_workers=max(1, len(layer_objects) - 1))
+
+        # Layer threads record into this thread's render profile, so one ChartPlotter render still gives one profile
+        profile = self.profiler.getCurrent()
+        futures = [self.layer_executor.submit(renderLayerWithAlpha, self.profiler, profile, layer, lower_left, upper_right, width_px, height_px, projection)
+                   for layer in layer_objects[1:]]
+        first_layer = layer_objects[0].plotChartWithAlpha(lower_left, upper_right, width_px, height_px, projection)
+
+        return [first_layer] + [future.result() for future in futures]
+
+    def planTileGrid(self, lower_left, upper_right, rows, columns):
+        """Splits a lat-lon box into rows x columns (lower_left, upper_right) boxes, row by row from the top"""
+        latitudes = numpy.linspace(upper_right[0], lower_left[0], rows + 1).tolist()
+        longitudes = numpy.linspace(lower_left[1], upper_right[1], columns + 1).tolist()
+
+        boxes = []
+        for i in range(rows):
+            for j in range(columns):
+                boxes.append(([latitudes[i + 1], longitudes[j]], [latitudes[i], longitudes[j + 1]]))
+
+        return boxes
+
+    def renderTiles(self, boxes, width_px, workers=None, callback=None, reuse_buffer=False):
+        """
+        Renders a list of (lower_left, upper_right) boxes across a process pool
+
+        Yields (index, image) in the order tiles finish, and passes the same pair to callback if one is given.
+        Each worker gets a pickled copy of this ChartPlotter and opens its own chart handles.
+        With workers=1 and reuse_buffer, every tile is drawn into the same buffer, so each image is only valid until the next one.
+        """
+
+        bounds = numpy.array([[lower_left[1], upper_right[1], lower_left[0], upper_right[0]] for lower_left, upper_right in boxes]).reshape(-1, 4)
+        heights_px = getImageHeightsFromWidth(bounds, width_px)
+
+        jobs = []
+        for index, (lower_left, upper_right) in enumerate(boxes):
+            jobs.append((index, lower_left, upper_right, width_px, int(heights_px[index])))
+
+        if workers is None:
+            workers = os.cpu_count() or 1
+
+        if workers <= 1:
+            tile_buffer = ImageBuffer(width_px, max(job[4] for job in jobs)) if reuse_buffer and len(jobs) > 0 else None
+
+            for index, lower_left, upper_right, tile_width, tile_height in jobs:
+                out = tile_buffer.getImage(tile_width, tile_height) if tile_buffer is not None else None
+                result = (index, self.plotChart(lower_left, upper_right, tile_width, tile_height, out=out))
+                if callback is not None:
+                    callback(*result)
+                yield result
+            return
+
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=getWorkerContext(), initializer=initTileWorker, initargs=(self,))
+        futures = [executor.submit(renderTileWorker, *job) for job in jobs]
+
+        try:
+            for future in as_completed(futures):
+                result = future.result()
+                if callback is not None:
+                    callback(*result)
+                yield result
+        finally:
+            # Stops queued tiles if the caller stops reading early
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+    def plotMosaicToFile(self, lower_left, upper_right, width_px, file_name, window_px=1024, callback=None):
+        """
+        Renders a large area window by window straight into a tiled, compressed GeoTIFF with overviews
+
+        Only one window is ever held in memory. callback(windows_done, window_count) is called after each window.
+        """
+
+        bounds = [lower_left[1], upper_right[1], lower_left[0], upper_right[0]]
+        height_px = getImageHeightFromWidth(bounds, width_px)
+        pixel_size_x = (bounds[1] - bounds[0]) / width_px
+        pixel_size_y = (bounds[3] - bounds[2]) / height_px
+
+        driver = gdal.GetDriverByName("GTiff")
+        options = ["TILED=YES", "BLOCKXSIZE=256", "BLOCKYSIZE=256", "COMPRESS=DEFLATE", "PREDICTOR=2", "PHOTOMETRIC=RGB", "BIGTIFF=IF_SAFER"]
+        mosaic = driver.Create(file_name, width_px, height_px, 3, gdal.GDT_Byte, options=options)
+        if mosaic is None:
+            raise Exception("could not create mosaic file: %s" % file_name)
+
+        spatial_reference = osr.SpatialReference()
+        spatial_reference.ImportFromEPSG(4326)
+        mosaic.SetProjection(spatial_reference.ExportToWkt())
+        mosaic.SetGeoTransform((bounds[0], pixel_size_x, 0, bounds[3], 0, -pixel_size_y))
+
+        window_count = ((width_px + window_px - 1) // window_px) * ((height_px + window_px - 1) // window_px)
+        windows_done = 0
+        window_buffer = ImageBuffer(min(window_px, width_px), min(window_px, height_px))
+
+        for row in range(0, height_px, window_px):
+            for column in range(0, width_px, window_px):
+                window_width = min(window_px, width_px - column)
+                window_height = min(window_px, height_px - row)
+
+                # Windows line up exactly with the mosaic's pixel grid
+                window_lower_left = [bounds[3] - (row + window_height) * pixel_size_y, bounds[0] + column * pixel_size_x]
+                window_upper_right = [bounds[3] - row * pixel_size_y, bounds[0] + (column + window_width) * pixel_size_x]
+                image = self.plotChart(window_lower_left, window_upper_right, window_width, window_height, out=window_buffer.getImage(window_width, window_height))
+
+                if image is not None:
+                    for band, channel in [(1, 2), (2, 1), (3, 0)]:  # Image is BGR, the GeoTIFF is RGB
+                        mosaic.GetRasterBand(band).WriteArray(image[:, :, channel], column, row)
+                image = None
+
+                windows_done += 1
+                if callback is not None:
+                    callback(windows_done, window_count)
+
+        buildOverviews(mosaic)
+        mosaic.FlushCache()
+        mosaic = None
+
     def getPossibleLayers(self):
         return self.layer_objects.keys()
 
@@ -52,3 +240,107 @@ class ChartPlotter(object):
 
     def setLayers(self, layers):
         self.layers = layers
+
+        # Sized for the number of layers, so it gets made again on the next render
+        if self.layer_executor is not None:
+            self.layer_executor.shutdown(wait=False)
+            self.layer_executor = None
+
+    def setProfiler(self, profiler):
+        """Sends timings of every render, by stage, chart and S-57 layer, to a RenderProfiler. None turns profiling off"""
+        self.profiler = profiler if profiler is not None else NULL_PROFILER
+        for layer in self.layer_objects.values():
+            if hasattr(layer, "setProfiler"):
+                layer.setProfiler(profiler)
+
+    @contextmanager
+    def profileRenders(self, callback=None):
+        """
+        Profiles renders inside the with block, e.g.
+
+        with chart_plotter.profileRenders() as profiler:
+            chart_plotter.plotChart(...)
+        print(profiler.getProfiles()[-1].toDict())
+        """
+        old_profiler = self.profiler
+        profiler = RenderProfiler(callback=callback)
+        self.setProfiler(profiler)
+        try:
+            yield profiler
+        finally:
+            self.setProfiler(old_profiler)
+
+    def getRenderConfigKey(self):
+        """Short hash of the layer set and every layer's render settings"""
+        config = [[layer, self.layer_objects[layer].getRenderConfig()] for layer in self.layers]
+        config_json = json.dumps(config, sort_keys=True, default=str)
+        return hashlib.sha1(config_json.encode()).hexdigest()[:16]
+
+
+def renderLayerWithAlpha(profiler, profile, layer, lower_left, upper_right, width_px, height_px, projection):
+    with profiler.attach(profile):
+        return layer.plotChartWithAlpha(lower_left, upper_right, width_px, height_px, projection)
+
+
+def blendLayer(image, layer_image, alpha):
+    """Alpha blends layer_image over image in place, alpha is uint8 or None for fully opaque"""
+    if layer_image.shape != image.shape:
+        raise Exception("layer image is %s, not %s" % (layer_image.shape, image.shape))
+
+    if alpha is None:
+        numpy.copyto(image, layer_image)
+        return
+
+    # Integer blend, (a * x + (255 - a) * y) / 255 rounded, stays in uint16
+    alpha = alpha[:, :, numpy.newaxis].astype(numpy.uint16)
+    blended = layer_image * alpha
+    blended += image * (255 - alpha)
+    blended += 127
+    blended //= 255
+    image[...] = blended
+
+
+def buildOverviews(data_set, min_size_px=256):
+    levels = []
+    level = 2
+    while max(data_set.RasterXSize, data_set.RasterYSize) / level >= min_size_px:
+        levels.append(level)
+        level *= 2
+
+    if len(levels) == 0:
+        return
+
+    # Internal overviews otherwise come out uncompressed
+    old_compression = gdal.GetConfigOption("COMPRESS_OVERVIEW")
+    gdal.SetConfigOption("COMPRESS_OVERVIEW", "DEFLATE")
+    try:
+        data_set.BuildOverviews("AVERAGE", levels)
+    finally:
+        gdal.SetConfigOption("COMPRESS_OVERVIEW", old_compression)
+
+
+"""TILE WORKERS"""
+
+worker_chart_plotter = None
+
+
+def getWorkerContext():
+    """
+    Worker processes are always spawned, so each one starts from a pickled ChartPlotter
+
+    Forked workers would inherit the parent's open OGR handles and SQLite connections, which can't be shared between processes
+    """
+    return multiprocessing.get_context("spawn")
+
+
+def initTileWorker(chart_plotter):
+    global worker_chart_plotter
+    worker_chart_plotter = chart_plotter
+
+
+def renderTileWorker(index, lower_left, upper_right, width_px, height_px):
+    return index, worker_chart_plotter.plotChart(lower_left, upper_right, width_px, height_px)
+
+
+def renderChartWorker(lower_left, upper_right, width_px, height_px, projection=None):
+    return worker_chart_plotter.plotChart(lower_left, upper_right, width_px, height_px, projection)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+"""
+XYZ tile API on top of ChartPlotter, with an in-memory and an on-disk tile cache
+"""
+
+import os
+import tempfile
+
+import numpy
+
+from .chart_plotter import ChartPlotter
+from .utility.conversions import tileToBounds
+from .utility.lru_cache import LRUCache, countBytes
+
+
+class TileRenderer(object):
+    """
+    Serves Web Mercator z/x/y tiles as OpenCV style images
+
+    Tiles are looked up in memory first, then in cache_dir, and only rendered with ChartPlotter on a miss of both.
+    Cache keys include the ChartPlotter layer set and render settings, so changing a palette or the charts on disk
+    never serves stale tiles. Neither cache level touches GDAL.
+
+    Tiles come back read-only, since the same array is handed to every caller of that tile. Copy one before drawing on it.
+    """
+
+    def __init__(self, chart_plotter: ChartPlotter, cache_dir=None, memory_budget_bytes=256 * 1024 * 1024, tile_size=256):
+        self.chart_plotter = chart_plotter
+        self.cache_dir = cache_dir
+        self.tile_size = tile_size
+        self.projection = "EPSG:3857"
+        self.memory_cache = LRUCache(memory_budget_bytes, size_function=countBytes)
+
+    def getTile(self, zoom, x, y):
+        config_key = self.chart_plotter.getRenderConfigKey()
+        tile_key = (config_key, self.tile_size, zoom, x, y)
+
+        image = self.memory_cache.get(tile_key)
+        if image is not None:
+            return image
+
+        image = self.readDiskTile(config_key, zoom, x, y)
+        if image is None:
+            image = self.renderTile(zoom, x, y)
+            self.writeDiskTile(config_key, zoom, x, y, image)
+
+        if image is None:
+            return None
+
+        image.setflags(write=False)
+        self.memory_cache.put(tile_key, image)
+        return image
+
+    def renderTile(self, zoom, x, y):
+        lower_left, upper_right = tileToBounds(zoom, x, y)
+        # Rendered straight in Web Mercator, so tiles line up with other slippy map layers
+        return self.chart_plotter.plotChart(lower_left, upper_right, self.tile_size, self.tile_size, self.projection)
+
+    def getTilePath(self, config_key, zoom, x, y):
+        return os.path.join(self.cache_dir, "{0}_{1}_{2}".format(config_key, self.tile_size, self.projection.replace(":", "")), str(zoom), str(x), "{0}.npy".format(y))
+
+    def readDiskTile(self, config_key, zoom, x, y):
+        if self.cache_dir is None:
+            return None
+
+        tile_path = self.getTilePath(config_key, zoom, x, y)
+        if not os.path.exists(tile_path):
+            return None
+
+        try:
+            return numpy.load(tile_path)
+        except (OSError, ValueError) as e:
+            print(f"Could not read cached tile {tile_path}: {e}")
+            return None
+
+    def writeDiskTile(self, config_key, zoom, x, y, image):
+        if self.cache_dir is None or image is None:
+            return
+
+        tile_path = self.getTilePath(config_key, zoom, x, y)
+        tile_dir = os.path.dirname(tile_path)
+        os.makedirs(tile_dir, exist_ok=True)
+
+        # Write to a temporary file first so readers never see half a tile
+        file_handle, temp_path = tempfile.mkstemp(dir=tile_dir, suffix=".tmp")
+        with os.fdopen(file_handle, "wb") as temp_file:
+            numpy.save(temp_file, image)
+        os.replace(temp_path, tile_path)
+
+    def clearMemoryCache(self):
+        self.memory_cache.clear()
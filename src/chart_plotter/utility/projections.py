@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+"""
+Cached projection lookups and coordinate transforms shared by the chart layers
+"""
+
+import threading
+
+import numpy
+from osgeo import osr
+
+from chart_plotter.utility.lru_cache import LRUCache
+
+# Shared by every layer in the process
+PROJECTION_CACHE = LRUCache(32)
+TRANSFORMED_BOUNDS_CACHE = LRUCache(1024)
+TRANSFORM_CACHES = threading.local()  # osr.CoordinateTransformation can't be used from two threads, so each keeps its own
+
+
+def getProjectionWkt(projection):
+    """WKT for anything osr.SetFromUserInput understands"""
+
+    def createWkt():
+        spatial_reference = osr.SpatialReference()
+        spatial_reference.SetFromUserInput(projection)
+        return spatial_reference.ExportToWkt()
+
+    return PROJECTION_CACHE.getOrCreate(projection, createWkt)
+
+
+def getCoordinateTransform(source_projection, target_projection) -> osr.CoordinateTransformation:
+    """Transform between two projections (WKT, "EPSG:xxxx", ...), both in x-y (lon-lat) order, cached per thread"""
+
+    def createTransform():
+        source = osr.SpatialReference()
+        source.SetFromUserInput(source_projection)
+        source.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+
+        target = osr.SpatialReference()
+        target.SetFromUserInput(target_projection)
+        target.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+
+        return osr.CoordinateTransformation(source, target)
+
+    if not hasattr(TRANSFORM_CACHES, "cache"):
+        TRANSFORM_CACHES.cache = LRUCache(32)
+    return TRANSFORM_CACHES.cache.getOrCreate((source_projection, target_projection), createTransform)
+
+
+def transformBounds(source_projection, target_projection, bounds, edge_points=21):
+    """
+    Bounding box in target_projection of [x_min, x_max, y_min, y_max] in source_projection
+
+    The edges get densified before transforming, so curved edges are covered
+    """
+
+    key = (source_projection, target_projection, tuple(bounds))
+    transformed_bounds = TRANSFORMED_BOUNDS_CACHE.get(key)
+    if transformed_bounds is not None:
+        return transformed_bounds
+
+    [x_min, x_max, y_min, y_max] = bounds
+    edge = numpy.linspace(0.0, 1.0, edge_points)
+    x_values = x_min + (x_max - x_min) * edge
+    y_values = y_min + (y_max - y_min) * edge
+
+    points = [(x, y_min) for x in x_values] + [(x, y_max) for x in x_values]
+    points += [(x_min, y) for y in y_values] + [(x_max, y) for y in y_values]
+    transformed = numpy.array(getCoordinateTransform(source_projection, target_projection).TransformPoints(points))
+
+    transformed_bounds = [float(transformed[:, 0].min()), float(transformed[:, 0].max()), float(transformed[:, 1].min()), float(transformed[:, 1].max())]
+    TRANSFORMED_BOUNDS_CACHE.put(key, transformed_bounds)
+    return transformed_bounds
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+"""
+Opt-in timing of the render path, broken down by stage, chart and S-57 layer
+"""
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from dataclasses import asdict, dataclass, field
+
+
+@dataclass
+class RenderProfile(object):
+    name: str  # What did the render, e.g. ChartPlotter or the layer class
+    lower_left: list = None
+    upper_right: list = None
+    size_px: list = None  # [width, height]
+    total_s: float = 0
+    stages: dict = field(default_factory=dict)  # Stage name -> seconds, summed over the render
+    layers: dict = field(default_factory=dict)  # S-57 layer -> {"seconds", "features", "calls"}
+    charts: list = field(default_factory=list)  # Charts touched, in draw order
+    bytes_allocated: int = 0  # Rasters and images allocated by the render
+
+    def toDict(self):
+        return asdict(self)
+
+
+class NullProfiler(object):
+    """Profiler that records nothing, used when profiling is off so the render path doesn't need any checks"""
+
+    enabled = False
+
+    def render(self, name, lower_left=None, upper_right=None, width_px=None, height_px=None):
+        return NULL_CONTEXT
+
+    def stage(self, name):
+        return NULL_CONTEXT
+
+    def layer(self, layer):
+        return NULL_CONTEXT
+
+    def getCurrent(self):
+        return None
+
+    def attach(self, profile):
+        return NULL_CONTEXT
+
+    def recordCharts(self, chart_names):
+        pass
+
+    def recordAllocation(self, nbytes):
+        pass
+
+
+NULL_CONTEXT = nullcontext()
+NULL_PROFILER = NullProfiler()
+
+
+class RenderProfiler(NullProfiler):
+    """
+    Records a RenderProfile for every render, keeping the last max_profiles of them in self.profiles
+
+    callback(profile) is called as each render finishes. Renders nest, so a ChartPlotter render that draws a NOAALayer
+    gives one profile. Each thread records its own renders, unless it attaches to another thread's profile (see attach).
+    """
+
+    enabled = True
+
+    def __init__(self, callback=None, max_profiles=1000):
+        self.callback = callback
+        self.profiles = deque(maxlen=max_profiles)
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def getCurrent(self):
+        return getattr(self.local, "profile", None)
+
+    @contextmanager
+    def attach(self, profile):
+        """Records into profile, e.g. the render of the thread that handed this one work, while inside the with block"""
+        old_profile = self.getCurrent()
+        self.local.profile = profile
+        try:
+            yield profile
+        finally:
+            self.local.profile = old_profile
+
+    @contextmanager
+    def render(self, name, lower_left=None, upper_right=None, width_px=None, height_px=None):
+        if self.getCurrent() is not None:  # Part of an outer render
+            yield self.getCurrent()
+            return
+
+        profile = RenderProfile(name=name, lower_left=lower_left, upper_right=upper_right, size_px=[width_px, height_px])
+        self.local.profile = profile
+        start = time.perf_counter()
+        try:
+            yield profile
+        finally:
+            profile.total_s = time.perf_counter() - start
+            self.local.profile = None
+
+            with self.lock:
+                self.profiles.append(profile)
+            if self.callback is not None:
+                self.callback(profile)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            profile = self.getCurrent()
+            if profile is not None:
+                with self.lock:
+                    profile.stages[name] = profile.stages.get(name, 0) + elapsed
+
+    @contextmanager
+    def layer(self, layer):
+        """
+        Times rasterizing an OGR layer, counting the features that pass its current filters
+
+        Counting can be a full pass over the layer (S-57 has no fast count), so it happens after the timing. Open stages
+        inside this, not around it, so they don't take in the count either.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            profile = self.getCurrent()
+            if profile is not None:
+                feature_count = max(0, layer.GetFeatureCount())
+                with self.lock:
+                    stats = profile.layers.setdefault(layer.GetDescription(), {"seconds": 0, "features": 0, "calls": 0})
+                    stats["seconds"] += elapsed
+                    stats["features"] += feature_count
+                    stats["calls"] += 1
+
+    def recordCharts(self, chart_names):
+        profile = self.getCurrent()
+        if profile is not None:
+            with self.lock:
+                profile.charts.extend(chart_names)
+
+    def recordAllocation(self, nbytes):
+        profile = self.getCurrent()
+        if profile is not None:
+            with self.lock:
+                profile.bytes_allocated += nbytes
+
+    def getProfiles(self):
+        with self.lock:
+            return list(self.profiles)
+
+    def clear(self):
+        with self.lock:
+            self.profiles.clear()
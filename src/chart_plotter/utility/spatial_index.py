@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+"""
+Spatial index over chart coverage polygons
+"""
+
+from shapely.geometry import Polygon, box
+from shapely.ops import unary_union
+from shapely.strtree import STRtree
+
+
+class CoverageIndex(object):
+    """
+    STRtree over the coverage rings of a set of named items (charts, raster files, ...)
+
+    Rings are lists of (lon, lat) points. The tree is built once, queries return item names in the order the items were added.
+    """
+
+    def __init__(self):
+        self.names = []
+        self.name_index = {}
+        self.polygons = []
+        self.polygon_owner = []  # Index into self.names for every polygon
+        self.tree = None
+        self.item_coverage = {}  # Union of each item's polygons, made on first use
+
+    def __getstate__(self):
+        # The tree gets rebuilt on the first query after unpickling
+        state = self.__dict__.copy()
+        state["tree"] = None
+        return state
+
+    def addItem(self, name, rings):
+        item_index = len(self.names)
+        self.names.append(name)
+        self.name_index[name] = item_index
+
+        for ring in rings:
+            if len(ring) < 3:
+                continue
+            self.polygons.append(Polygon(ring))
+            self.polygon_owner.append(item_index)
+
+        self.tree = None  # Rebuilt on next query
+
+    def build(self):
+        self.tree = STRtree(self.polygons)
+
+    def query(self, lower_left, upper_right):
+        """Returns the names of every item whose coverage intersects the lat-lon box, without duplicates"""
+        if len(self.polygons) == 0:
+            return []
+        if self.tree is None:
+            self.build()
+
+        query_box = box(lower_left[1], lower_left[0], upper_right[1], upper_right[0])
+        polygon_indices = self.tree.query(query_box, predicate="intersects")
+        item_indices = sorted(set(self.polygon_owner[i] for i in polygon_indices))
+
+        return [self.names[i] for i in item_indices]
+
+    def getCoverage(self, name):
+        """Union of all the coverage polygons of one item"""
+        if name not in self.item_coverage:
+            item_index = self.name_index[name]
+            polygons = [polygon for polygon, owner in zip(self.polygons, self.polygon_owner) if owner == item_index]
+            self.item_coverage[name] = unary_union(polygons)
+
+        return self.item_coverage[name]
+
+    def __len__(self):
+        return len(self.names)
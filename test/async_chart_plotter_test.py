@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+"""
+Checks AsyncChartPlotter request coalescing, cancellation and queue limits
+
+Uses a stand-in plotter with workers=0, so it needs no chart data and renders take as long as the test says.
+
+Usage: async_chart_plotter_test.py
+"""
+
+import asyncio
+import threading
+import time
+
+from chart_plotter.async_chart_plotter import AsyncChartPlotter, RenderQueueFull
+
+RENDER_TIME_S = 0.05
+
+
+class StubChartPlotter(object):
+    """Just enough of a ChartPlotter for AsyncChartPlotter, counts the renders it is asked for"""
+
+    def __init__(self):
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def getRenderConfigKey(self):
+        return "stub"
+
+    def plotChart(self, lower_left, upper_right, width_px, height_px, projection=None):
+        with self.lock:
+            self.calls.append((tuple(lower_left), tuple(upper_right)))
+        time.sleep(RENDER_TIME_S)
+        return [lower_left, upper_right, width_px, height_px]
+
+
+def getOutcomes(results):
+    return [type(result).__name__ if isinstance(result, BaseException) else "ok" for result in results]
+
+
+async def checkCoalescing():
+    chart_plotter = StubChartPlotter()
+    async_plotter = AsyncChartPlotter(chart_plotter, workers=0)
+
+    # Boxes that only differ past COALESCE_DECIMALS are the same request
+    images = await asyncio.gather(*[async_plotter.plotChart([41.5, -70.7 + i * 1e-10], [41.6, -70.6], 256, 256) for i in range(3)])
+    assert len(chart_plotter.calls) == 1, chart_plotter.calls
+    assert images[0] is images[1] is images[2]
+
+    await async_plotter.plotChart([41.5, -70.7], [41.6, -70.6], 256, 256)
+    assert len(chart_plotter.calls) == 2, "finished renders shouldn't be shared"
+    await async_plotter.close()
+
+
+async def checkCancelThenRerequest():
+    chart_plotter = StubChartPlotter()
+    async_plotter = AsyncChartPlotter(chart_plotter, workers=0, max_in_flight=1)
+
+    running = asyncio.ensure_future(async_plotter.plotChart([0, 0], [1, 1], 16, 16))
+    waiting = asyncio.ensure_future(async_plotter.plotChart([0, 0], [2, 2], 16, 16))
+    await asyncio.sleep(RENDER_TIME_S / 5)
+
+    # The only client of the waiting render goes away, and an identical request comes in right after
+    waiting.cancel()
+    await asyncio.sleep(0)
+    again = asyncio.ensure_future(async_plotter.plotChart([0, 0], [2, 2], 16, 16))
+
+    results = await asyncio.gather(running, waiting, again, return_exceptions=True)
+    assert getOutcomes(results) == ["ok", "CancelledError", "ok"], getOutcomes(results)
+    assert results[2][1] == [2, 2]
+    assert async_plotter.slots_taken == 0 and async_plotter.getInFlightCount() == 0
+    await async_plotter.close()
+
+
+async def checkQueueLimit():
+    chart_plotter = StubChartPlotter()
+    async_plotter = AsyncChartPlotter(chart_plotter, workers=0, max_in_flight=1, max_queued=2)
+
+    # One render holds the slot and two wait for it, the rest are turned away
+    requests = [asyncio.ensure_future(async_plotter.plotChart([0, 0], [1, i + 1], 16, 16)) for i in range(5)]
+    results = await asyncio.gather(*requests, return_exceptions=True)
+    assert getOutcomes(results) == ["ok", "ok", "ok", "RenderQueueFull", "RenderQueueFull"], getOutcomes(results)
+    assert isinstance(results[3], RenderQueueFull)
+    assert len(chart_plotter.calls) == 3
+
+    # Once the queue drains there's room again
+    await async_plotter.plotChart([0, 0], [1, 9], 16, 16)
+    assert async_plotter.slots_taken == 0 and async_plotter.getQueuedCount() == 0
+    await async_plotter.close()
+
+
+async def main():
+    await checkCoalescing()
+    await checkCancelThenRerequest()
+    await checkQueueLimit()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
+    print("AsyncChartPlotter OK")
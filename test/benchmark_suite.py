@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+"""
+Reproducible benchmarks of the render pipeline on synthetic charts (see synthetic_charts.py)
+
+Times NOAALayer startup, chart lookup, plotChart at several resolutions, feature queries and tile grid throughput
+for each chart set size, and saves the results as JSON so runs from different commits can be compared.
+
+Usage: benchmark_suite.py [--sizes small medium large] [--output results.json] [--compare old_results.json]
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+
+import numpy
+from osgeo import gdal
+
+from chart_plotter.chart_layers.noaa_layer import NOAALayer
+from chart_plotter.chart_plotter import ChartPlotter
+from synthetic_charts import CHART_SET_LOWER_LEFT, CHART_SET_UPPER_RIGHT, CHART_SET_SIZES, makeChartSet
+
+PLOT_WIDTHS_PX = [256, 1024, 2048]
+LOOKUP_QUERIES = 1000
+DEPTH_QUERY_POINTS = 100000
+GRID_SIZE = 4
+GRID_TILE_PX = 256
+REPEATS = 5
+
+
+def timeFunction(function, repeats=REPEATS):
+    """Runs function repeats times, returns the best and median time in seconds"""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    return {"best_s": min(times), "median_s": statistics.median(times), "repeats": repeats}
+
+
+def getRandomBoxes(count, seed=0):
+    random_generator = random.Random(seed)
+    lat_span = CHART_SET_UPPER_RIGHT[0] - CHART_SET_LOWER_LEFT[0]
+    lon_span = CHART_SET_UPPER_RIGHT[1] - CHART_SET_LOWER_LEFT[1]
+
+    boxes = []
+    for _ in range(count):
+        size = random_generator.uniform(0.01, 0.5)
+        lat = CHART_SET_LOWER_LEFT[0] + random_generator.uniform(0, 1 - size) * lat_span
+        lon = CHART_SET_LOWER_LEFT[1] + random_generator.uniform(0, 1 - size) * lon_span
+        boxes.append(([lat, lon], [lat + size * lat_span, lon + size * lon_span]))
+
+    return boxes
+
+
+def benchmarkChartSet(chart_dir):
+    results = {}
+
+    # Startup, once reading every chart into a new catalog and once from the existing catalog
+    catalog_path = os.path.join(chart_dir, "chart_catalog.sqlite")
+
+    def coldStartup():
+        if os.path.exists(catalog_path):
+            os.remove(catalog_path)
+        NOAALayer(chart_dir=chart_dir)
+
+    results["startup_cold"] = timeFunction(coldStartup, repeats=3)
+    results["startup_warm"] = timeFunction(lambda: NOAALayer(chart_dir=chart_dir))
+
+    layer = NOAALayer(chart_dir=chart_dir)
+    lookup_boxes = getRandomBoxes(LOOKUP_QUERIES)
+
+    def lookups():
+        for lower_left, upper_right in lookup_boxes:
+            layer.getNeededCharts(lower_left, upper_right)
+
+    results["getNeededCharts_x{0}".format(LOOKUP_QUERIES)] = timeFunction(lookups)
+
+    for width_px in PLOT_WIDTHS_PX:
+        results["plotChart_{0}px".format(width_px)] = timeFunction(lambda: layer.plotChart(CHART_SET_LOWER_LEFT, CHART_SET_UPPER_RIGHT, width_px, width_px))
+
+    lat_middle = (CHART_SET_LOWER_LEFT[0] + CHART_SET_UPPER_RIGHT[0]) / 2
+    lon_middle = (CHART_SET_LOWER_LEFT[1] + CHART_SET_UPPER_RIGHT[1]) / 2
+    results["getShapesFromLayers"] = timeFunction(lambda: layer.getShapesFromLayers(CHART_SET_LOWER_LEFT, [lat_middle, lon_middle], ["DEPARE", "LNDARE"]))
+
+    def writeGeoJSONSeq():
+        with open(os.devnull, "w") as output_file:
+            layer.writeGeoJSONSeq(output_file, CHART_SET_LOWER_LEFT, CHART_SET_UPPER_RIGHT, ["DEPARE", "SOUNDG"])
+
+    results["writeGeoJSONSeq"] = timeFunction(writeGeoJSONSeq)
+
+    random_generator = numpy.random.default_rng(0)
+    latitudes = random_generator.uniform(CHART_SET_LOWER_LEFT[0], CHART_SET_UPPER_RIGHT[0], DEPTH_QUERY_POINTS)
+    longitudes = random_generator.uniform(CHART_SET_LOWER_LEFT[1], CHART_SET_UPPER_RIGHT[1], DEPTH_QUERY_POINTS)
+    results["buildDepthIndexes"] = timeFunction(lambda: layer.buildDepthIndexes(), repeats=1)
+    results["queryDepths_x{0}".format(DEPTH_QUERY_POINTS)] = timeFunction(lambda: layer.queryDepths(latitudes, longitudes))
+
+    # Tile grids through ChartPlotter, in process and across a process pool
+    chart_plotter = ChartPlotter(noaa_chart_directory=chart_dir)
+    boxes = chart_plotter.planTileGrid(CHART_SET_LOWER_LEFT, CHART_SET_UPPER_RIGHT, GRID_SIZE, GRID_SIZE)
+
+    for workers in [1, os.cpu_count() or 1]:
+        timing = timeFunction(lambda: list(chart_plotter.renderTiles(boxes, GRID_TILE_PX, workers=workers)), repeats=3)
+        timing["tiles_per_s"] = len(boxes) / timing["best_s"]
+        results["renderTiles_{0}x{0}_workers{1}".format(GRID_SIZE, workers)] = timing
+
+    return results
+
+
+def getCommit():
+    try:
+        repo_dir = os.path.dirname(os.path.abspath(__file__))
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=repo_dir, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compareResults(old_results, new_results):
+    print("{0:>8} {1:>34} {2:>12} {3:>12} {4:>8}".format("size", "benchmark", "old (ms)", "new (ms)", "ratio"))
+    for size, benchmarks in new_results["results"].items():
+        for name, timing in benchmarks.items():
+            old_timing = old_results["results"].get(size, {}).get(name)
+            if old_timing is None:
+                continue
+            ratio = timing["best_s"] / old_timing["best_s"]
+            print("{0:>8} {1:>34} {2:>12.2f} {3:>12.2f} {4:>8.2f}".format(size, name, old_timing["best_s"] * 1000, timing["best_s"] * 1000, ratio))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", default=list(CHART_SET_SIZES.keys()), choices=list(CHART_SET_SIZES.keys()))
+    parser.add_argument("--output", default=None, help="JSON file to save results to, defaults to benchmark_<commit>.json")
+    parser.add_argument("--compare", default=None, help="Earlier results JSON to compare against")
+    args = parser.parse_args()
+
+    commit = getCommit()
+    output = {"commit": commit,
+              "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "python": platform.python_version(),
+              "gdal": gdal.__version__,
+              "machine": platform.machine(),
+              "cpu_count": os.cpu_count(),
+              "results": {}}
+
+    for size in args.sizes:
+        chart_dir = tempfile.mkdtemp(prefix="chart_benchmark_{0}_".format(size))
+        try:
+            start = time.perf_counter()
+            chart_names = makeChartSet(chart_dir, size)
+            print("Generated {0} {1} charts in {2:.1f} s".format(len(chart_names), size, time.perf_counter() - start))
+
+            output["results"][size] = benchmarkChartSet(chart_dir)
+            for name, timing in output["results"][size].items():
+                print("{0:>8} {1:>34} {2:>10.2f} ms".format(size, name, timing["best_s"] * 1000))
+        finally:
+            shutil.rmtree(chart_dir, ignore_errors=True)
+
+    output_path = args.output or "benchmark_{0}.json".format(commit)
+    with open(output_path, "w") as output_file:
+        json.dump(output, output_file, indent=2)
+    print("Saved results to {0}".format(output_path))
+
+    if args.compare is not None:
+        with open(args.compare) as compare_file:
+            compareResults(json.load(compare_file), output)
+
+
+if __name__ == '__main__':
+    main()
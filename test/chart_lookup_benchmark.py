@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+"""
+Compares chart lookup latency of the coverage STRtree against the old linear scan
+
+Uses synthetic chart coverage so it runs without any NOAA data
+"""
+
+import random
+import time
+
+from shapely.geometry import Polygon
+
+from chart_plotter.utility.spatial_index import CoverageIndex
+
+REGION_LOWER_LEFT = [24.0, -98.0]
+REGION_UPPER_RIGHT = [49.0, -66.0]
+QUERIES = 500
+
+
+def makeCoverage(chart_count, seed=0):
+    """Random rectangular cells of harbor to coastal size, some with a couple of coverage rings"""
+    rng = random.Random(seed)
+    coverage = {}
+
+    for i in range(chart_count):
+        rings = []
+        for _ in range(rng.randint(1, 3)):
+            size = rng.uniform(0.05, 1.0)
+            lon = rng.uniform(REGION_LOWER_LEFT[1], REGION_UPPER_RIGHT[1] - size)
+            lat = rng.uniform(REGION_LOWER_LEFT[0], REGION_UPPER_RIGHT[0] - size)
+            rings.append([(lon, lat), (lon, lat + size), (lon + size, lat + size), (lon + size, lat), (lon, lat)])
+        coverage["SYN{0:05d}".format(i)] = rings
+
+    return coverage
+
+
+def makeQueries(seed=1):
+    rng = random.Random(seed)
+    queries = []
+
+    for _ in range(QUERIES):
+        size = rng.uniform(0.01, 0.2)
+        lat = rng.uniform(REGION_LOWER_LEFT[0], REGION_UPPER_RIGHT[0] - size)
+        lon = rng.uniform(REGION_LOWER_LEFT[1], REGION_UPPER_RIGHT[1] - size)
+        queries.append(([lat, lon], [lat + size, lon + size]))
+
+    return queries
+
+
+def linearScan(coverage, lower_left, upper_right):
+    """The pre-index NOAALayer.getNeededCharts"""
+    chart_list = []
+    p1 = Polygon([(lower_left[1], lower_left[0]), (lower_left[1], upper_right[0]), (upper_right[1], upper_right[0]), (upper_right[1], lower_left[0])])
+
+    for file in coverage:
+        for polygon in coverage[file]:
+            p2 = Polygon(polygon)
+            if p1.intersects(p2):
+                if file not in chart_list:
+                    chart_list.append(file)
+
+    return chart_list
+
+
+def timeQueries(function, queries):
+    start = time.perf_counter()
+    results = [function(lower_left, upper_right) for lower_left, upper_right in queries]
+    return (time.perf_counter() - start) / len(queries), results
+
+
+def main():
+    queries = makeQueries()
+
+    print("{0:>8} {1:>14} {2:>14} {3:>10}".format("charts", "linear (ms)", "index (ms)", "speedup"))
+    for chart_count in [10, 100, 1000, 5000]:
+        coverage = makeCoverage(chart_count)
+
+        index = CoverageIndex()
+        for name in coverage:
+            index.addItem(name, coverage[name])
+        index.build()
+
+        linear_time, linear_results = timeQueries(lambda ll, ur: linearScan(coverage, ll, ur), queries)
+        index_time, index_results = timeQueries(index.query, queries)
+
+        if linear_results != index_results:
+            raise Exception("Index and linear scan disagree at {0} charts".format(chart_count))
+
+        print("{0:>8} {1:>14.4f} {2:>14.4f} {3:>9.1f}x".format(chart_count, linear_time * 1000, index_time * 1000, linear_time / index_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+
+"""
+Compares tile render latency from the raw S-57 charts against the compiled GeoPackage cache
+
+Usage: compiled_cache_benchmark.py [chart_dir]
+"""
+
+import sys
+import time
+
+from chart_plotter.chart_plotter import ChartPlotter
+from benchmark_suite import timeFunction
+
+LOWER_LEFT = [41.519489, -70.7288717]
+UPPER_RIGHT = [41.550559, -70.6228197]
+TILES = 8
+TILE_SIZE_PX = 256
+REPEATS = 3
+
+
+def timeTiles(layer, boxes):
+    """Best time per tile over REPEATS passes of the grid"""
+
+    def renderTiles():
+        for lower_left, upper_right in boxes:
+            layer.plotChart(lower_left, upper_right, TILE_SIZE_PX, TILE_SIZE_PX)
+
+    return timeFunction(renderTiles, repeats=REPEATS)["best_s"] / len(boxes)
+
+
+def main():
+    chart_dir = sys.argv[1] if len(sys.argv) > 1 else None
+    chart_plotter = ChartPlotter(noaa_chart_directory=chart_dir)
+    layer = chart_plotter.getLayer("NOAA")
+    boxes = chart_plotter.planTileGrid(LOWER_LEFT, UPPER_RIGHT, TILES, TILES)
+
+    start = time.perf_counter()
+    layer.compileCharts()
+    print("Compiled {0} charts in {1:.1f} s".format(len(layer.compiled_charts), time.perf_counter() - start))
+
+    layer.setUseCompiledCharts(False)
+    raw_time = timeTiles(layer, boxes)
+
+    layer.setUseCompiledCharts(True)
+    compiled_time = timeTiles(layer, boxes)
+
+    print("{0:>10} {1:>14}".format("source", "ms per tile"))
+    print("{0:>10} {1:>14.2f}".format("S-57", raw_time * 1000))
+    print("{0:>10} {1:>14.2f}".format("compiled", compiled_time * 1000))
+
+
+if __name__ == '__main__':
+    main()
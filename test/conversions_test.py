@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+
+"""
+Checks the vectorized box conversions against the navpy functions they batch up
+
+Usage: conversions_test.py [boxes]
+"""
+
+import sys
+
+import navpy
+import numpy
+
+from chart_plotter.utility.conversions import boxDimensions, boxDimensionsArray, getImageHeightFromWidth, getImageHeightsFromWidth, upperRightFromSize
+
+WIDTH_PX = 256
+DIMENSION_TOLERANCE_M = 1e-6
+CORNER_TOLERANCE_DEGREES = 1e-9
+
+if __name__ == '__main__':
+    box_count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    random = numpy.random.default_rng(0)
+
+    # Chart sized boxes anywhere charts are, from harbor plans to overview charts
+    lat_min = random.uniform(-70.0, 70.0, box_count)
+    lon_min = random.uniform(-180.0, 179.0, box_count)
+    sizes = 10.0 ** random.uniform(-4.0, 0.0, (box_count, 2))
+    bounds = numpy.stack([lon_min, lon_min + sizes[:, 0], lat_min, lat_min + sizes[:, 1]], axis=1)
+
+    widths_m, heights_m = boxDimensionsArray(bounds)
+    heights_px = getImageHeightsFromWidth(bounds, WIDTH_PX)
+    expected = numpy.array([boxDimensions(box) for box in bounds])
+    expected_heights_px = numpy.array([getImageHeightFromWidth(box, WIDTH_PX) for box in bounds])
+
+    dimension_error = max(numpy.max(numpy.abs(widths_m - expected[:, 0])), numpy.max(numpy.abs(heights_m - expected[:, 1])))
+    assert dimension_error < DIMENSION_TOLERANCE_M, dimension_error
+    assert numpy.array_equal(heights_px, expected_heights_px), numpy.flatnonzero(heights_px != expected_heights_px)
+
+    lower_lefts = numpy.stack([lat_min, lon_min], axis=1)
+    upper_rights = upperRightFromSize(lower_lefts, widths_m, heights_m)
+    expected_corners = numpy.array([navpy.ned2lla((north, east, 0), lat, lon, 0)[0:2]
+                                    for lat, lon, east, north in zip(lat_min, lon_min, widths_m, heights_m)])
+
+    corner_error = numpy.max(numpy.abs(upper_rights - expected_corners))
+    assert corner_error < CORNER_TOLERANCE_DEGREES, corner_error
+
+    print("{0} boxes OK, dimension error {1:.1e} m, corner error {2:.1e} degrees".format(box_count, dimension_error, corner_error))
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+"""
+Checks that deduplicated feature queries only drop features a more detailed chart covers completely
+
+Builds a coarse synthetic chart set with a detailed harbor chart on top, then adds two depth areas to the coarse chart
+under the harbor: one entirely inside it, which belongs to the harbor chart, and one centered in it but reaching past it,
+which only the coarse chart has.
+
+Usage: dedupe_test.py
+"""
+
+import os
+import random
+import tempfile
+
+from osgeo import ogr
+
+from chart_plotter.chart_layers.noaa_layer import NOAALayer
+from synthetic_charts import addFeature, makeBox, makeChart, makeChartSet
+
+HARBOR_BOUNDS = [-70.76, -70.72, 41.47, 41.50]
+INSIDE_DEPTH = 98.0  # DRVAL1 of the area entirely inside the harbor chart
+REACHING_DEPTH = 99.0  # DRVAL1 of the area centered in the harbor chart but reaching past it
+
+
+def getChartDepths(layer, chart, dedupe):
+    """DRVAL1 of the depth areas a feature query around the harbor returns from one chart"""
+    depths = set()
+    for layer_name, chart_name, feature in layer.iterFeaturesInBounds([41.46, -70.79], [41.51, -70.69], "DEPARE", dedupe):
+        if chart_name == chart:
+            depths.add(feature.GetField("DRVAL1"))
+
+    return depths
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as chart_dir:
+        coarse_chart = makeChartSet(chart_dir, "small", usage_band=3)[0]  # Lower left quarter of the set, under the harbor
+        makeChart(os.path.join(chart_dir, "US5HB000", "US5HB000.000"), HARBOR_BOUNDS, 4, 5, random.Random(0))
+
+        chart = ogr.Open(os.path.join(chart_dir, coarse_chart, "{0}.000".format(coarse_chart)), 1)
+        depare = chart.GetLayerByName("DEPARE")
+        addFeature(depare, makeBox(-70.75, 41.48, -70.73, 41.49), {"DRVAL1": INSIDE_DEPTH, "DRVAL2": INSIDE_DEPTH + 5})
+        addFeature(depare, makeBox(-70.78, 41.48, -70.70, 41.49), {"DRVAL1": REACHING_DEPTH, "DRVAL2": REACHING_DEPTH + 5})
+        chart = None
+
+        noaa_layer = NOAALayer(chart_dir=chart_dir)
+        assert {INSIDE_DEPTH, REACHING_DEPTH} <= getChartDepths(noaa_layer, coarse_chart, dedupe=False)
+
+        deduped_depths = getChartDepths(noaa_layer, coarse_chart, dedupe=True)
+        assert REACHING_DEPTH in deduped_depths, "feature reaching out of the harbor chart was dropped"
+        assert INSIDE_DEPTH not in deduped_depths, "feature inside the harbor chart wasn't deduplicated"
+
+    print("Dedupe OK")
@@ -5,7 +5,6 @@ test code for ChartPlotter
 """
 
 import cv2
-import numpy
 import numpy as np
 
 from chart_plotter.chart_plotter import ChartPlotter
@@ -19,43 +18,17 @@ if __name__ == '__main__':
     boxes = 8
     boxWidth = 200
 
-    latitudes = numpy.linspace(globalUpperRight[0], globalLowerLeft[0], boxes + 1)
-    longitudes = numpy.linspace(globalLowerLeft[1], globalUpperRight[1], boxes + 1)
+    tileBoxes = chartPlotter.planTileGrid(globalLowerLeft, globalUpperRight, boxes, boxes)
 
-    image = None
+    # Tiles come back in the order the workers finish them, so keep them by index until the grid is complete
+    tiles = {}
+    for count, (tileIndex, im) in enumerate(chartPlotter.renderTiles(tileBoxes, boxWidth)):
+        print("{0} of {1}".format(count + 1, boxes * boxes))
+        tiles[divmod(tileIndex, boxes)] = im
 
-    for i in range(len(latitudes) - 1):
-        for j in range(len(longitudes) - 1):
-            print("{0} of {1}".format(i * boxes + j + 1, boxes * boxes))
-
-            lowerLeft = (latitudes[i + 1], longitudes[j])
-            upperRight = (latitudes[i], longitudes[j + 1])
-            im = chartPlotter.plotChartByWidth(lowerLeft, upperRight, boxWidth)
-
-            [imHeight, imWidth, _] = im.shape
-
-            if image is None:
-                image = np.zeros([imHeight, imWidth, 3], dtype=np.uint8)
-
-            startRow = (imHeight * i)
-            endRow = startRow + imHeight
-            startColumn = imWidth * j
-            endColumn = startColumn + imWidth
-
-            [rows, columns, _] = image.shape
-            if rows < endRow:
-                extraRows = endRow - rows
-                extraImage = np.zeros([extraRows, columns, 3], dtype=np.uint8)
-                image = np.concatenate([image, extraImage], axis=0)
-            if columns < endColumn:
-                extraColumns = endColumn - columns
-                extraImage = np.zeros([rows, extraColumns, 3], dtype=np.uint8)
-                image = np.concatenate([image, extraImage], axis=1)
-
-            image[startRow:endRow, startColumn:endColumn, 0:2] = im[:, :, 0:2]
-
-            cv2.imshow("Output", image)
-            cv2.waitKey(1)
+    # Tiles in a row share a height, and every column has the same width
+    rows = [np.concatenate([tiles[(i, j)] for j in range(boxes)], axis=1) for i in range(boxes)]
+    image = np.concatenate(rows, axis=0)
 
     cv2.imwrite("Output.png", image)
     cv2.imshow("Output", image)
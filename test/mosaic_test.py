@@ -0,0 +1,20 @@
+#!/usr/bin/env python3
+
+"""
+Renders the large_test.py area at high resolution straight into a tiled GeoTIFF
+"""
+
+from chart_plotter.chart_plotter import ChartPlotter
+
+
+def printProgress(windows_done, window_count):
+    print("{0} of {1}".format(windows_done, window_count))
+
+
+if __name__ == '__main__':
+    chartPlotter = ChartPlotter()
+
+    globalLowerLeft = [41.519489, -70.7288717]
+    globalUpperRight = [41.550559, -70.6228197]
+
+    chartPlotter.plotMosaicToFile(globalLowerLeft, globalUpperRight, 8000, "Mosaic.tif", window_px=1024, callback=printProgress)
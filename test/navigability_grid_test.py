@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+
+"""
+Checks NavigabilityGrid.getClassRange against a brute force min/max over random grids and boxes
+
+Needs no chart data, the grids are made up.
+
+Usage: navigability_grid_test.py [boxes_per_grid]
+"""
+
+import sys
+
+import numpy
+
+from chart_plotter.utility import navigability_grid
+from chart_plotter.utility.navigability_grid import NavigabilityGrid
+
+GRID_SHAPES = [(1, 1), (1, 37), (64, 64), (100, 77), (257, 130)]
+
+
+def makeClasses(shape, random):
+    """Mostly navigable water with a few hazards, so small boxes are often clear and big ones never are"""
+    classes = numpy.where(random.random(shape) < 0.97, navigability_grid.NAVIGABLE, random.integers(1, 5, shape))
+    return classes.astype(numpy.uint8)
+
+
+def bruteForceRange(classes, row_min, row_max, column_min, column_max):
+    cells = classes[max(row_min, 0):max(row_max, 0), max(column_min, 0):max(column_max, 0)]
+    if cells.size == 0:
+        return None
+    return int(cells.min()), int(cells.max())
+
+
+if __name__ == '__main__':
+    box_count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    random = numpy.random.default_rng(0)
+
+    for shape in GRID_SHAPES:
+        classes = makeClasses(shape, random)
+        grid = NavigabilityGrid(classes, [0.0, float(shape[1]), 0.0, float(shape[0])])
+        assert numpy.array_equal(grid.unpackMask(grid.getPackedMask()), classes > navigability_grid.NAVIGABLE)
+
+        # Boxes may hang off any edge of the grid, or miss it altogether
+        for _ in range(box_count):
+            row_min, row_max = sorted(random.integers(-4, shape[0] + 5, 2))
+            column_min, column_max = sorted(random.integers(-4, shape[1] + 5, 2))
+
+            expected = bruteForceRange(classes, row_min, row_max, column_min, column_max)
+            class_range = grid.getClassRange(row_min, row_max, column_min, column_max)
+            assert class_range == expected, (shape, row_min, row_max, column_min, column_max, class_range, expected)
+
+    print("Class ranges OK on {0} grids".format(len(GRID_SHAPES)))
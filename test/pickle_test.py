@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+
+"""
+Checks that a ChartPlotter survives the pickle round trip every spawned tile worker goes through
+
+Usage: pickle_test.py [chart_dir]
+"""
+
+import pickle
+import sys
+
+import numpy
+
+from chart_plotter.chart_plotter import ChartPlotter
+from chart_plotter.utility.lru_cache import LRUCache, countBytes
+
+LOWER_LEFT = [41.519489, -70.7288717]
+UPPER_RIGHT = [41.550559, -70.6228197]
+
+if __name__ == '__main__':
+    cache = LRUCache(1024, size_function=countBytes)
+    cache.put("image", numpy.zeros(16, dtype=numpy.uint8))
+    cache_copy = pickle.loads(pickle.dumps(cache))
+    assert len(cache_copy) == 0 and cache_copy.max_size == 1024 and cache_copy.size_function is countBytes
+
+    chart_plotter = ChartPlotter(noaa_chart_directory=sys.argv[1] if len(sys.argv) > 1 else None)
+    image = chart_plotter.plotChart(LOWER_LEFT, UPPER_RIGHT, 256, 256)  # Fills the handle pools before pickling
+
+    chart_plotter_copy = pickle.loads(pickle.dumps(chart_plotter))
+    assert len(chart_plotter_copy.getLayer("NOAA").open_charts) == 0
+    assert chart_plotter_copy.getRenderConfigKey() == chart_plotter.getRenderConfigKey()
+    assert numpy.array_equal(chart_plotter_copy.plotChart(LOWER_LEFT, UPPER_RIGHT, 256, 256), image)
+
+    tiles = dict(chart_plotter.renderTiles(chart_plotter.planTileGrid(LOWER_LEFT, UPPER_RIGHT, 2, 2), 256, workers=2))
+    assert len(tiles) == 4
+    print("Pickle round trip OK")
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+"""
+Times NOAALayer.plotChart against the old render path that copied every chart into a Memory datasource
+
+Each mode runs in its own process so the peak memory numbers don't mix
+Usage: render_benchmark.py [chart_dir]
+"""
+
+import resource
+import subprocess
+import sys
+import time
+
+from osgeo import gdal, ogr
+
+from chart_plotter.chart_layers import noaa_layer
+from chart_plotter.chart_layers.noaa_layer import NOAALayer
+
+LOWER_LEFT = [41.519489, -70.7288717]
+UPPER_RIGHT = [41.550559, -70.6228197]
+TILES = 8
+TILE_SIZE_PX = 256
+REPEATS = 3
+
+
+class LegacyNOAALayer(NOAALayer):
+    """Render path from before the attribute-filter DEPARE split"""
+
+    def parseSingleChart(self, file, raster_image, *args, **kwargs):
+        vector_source = ogr.GetDriverByName("Memory").CopyDataSource(file, "")
+
+        for layerNumber in self.getSortedLayerNames(file):
+            try:
+                layer = vector_source.GetLayer(layerNumber)
+                if layer.GetDescription() == "DEPARE":
+                    legacyDepthLayer(layer, raster_image, self.color_palette["SHALLOW_WATER"], self.color_palette["WHITE"], self.shallow_water_depth)
+                else:
+                    self.rasterizeSingleLayer(layer, raster_image)
+            except Exception as e:
+                print(e)
+
+
+def legacyDepthLayer(layer, raster_image, shallow_color, deep_color, depth_cutoff):
+    source = ogr.GetDriverByName('MEMORY').CreateDataSource('memData')
+    deep_layer = source.CreateLayer("DEEP", layer.GetSpatialRef())
+
+    for i in range(layer.GetFeatureCount()):
+        feature = layer.GetNextFeature()
+        min_depth = float(feature.GetField(noaa_layer.MIN_DEPTH_KEY))
+
+        if min_depth > depth_cutoff:
+            deep_layer.SetFeature(feature)
+            layer.DeleteFeature(feature.GetFID())
+
+    gdal.RasterizeLayer(raster_image, noaa_layer.BGR_BANDS, layer, burn_values=shallow_color)
+    gdal.RasterizeLayer(raster_image, noaa_layer.BGR_BANDS, deep_layer, burn_values=deep_color)
+
+
+def getTileBoxes():
+    boxes = []
+    lat_step = (UPPER_RIGHT[0] - LOWER_LEFT[0]) / TILES
+    lon_step = (UPPER_RIGHT[1] - LOWER_LEFT[1]) / TILES
+
+    for i in range(TILES):
+        for j in range(TILES):
+            lower_left = [LOWER_LEFT[0] + i * lat_step, LOWER_LEFT[1] + j * lon_step]
+            upper_right = [lower_left[0] + lat_step, lower_left[1] + lon_step]
+            boxes.append((lower_left, upper_right))
+
+    return boxes
+
+
+def runMode(mode, chart_dir):
+    layer_class = LegacyNOAALayer if mode == "legacy" else NOAALayer
+    layer = layer_class(chart_dir=chart_dir)
+    boxes = getTileBoxes()
+
+    best = None
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        for lower_left, upper_right in boxes:
+            layer.plotChart(lower_left, upper_right, TILE_SIZE_PX, TILE_SIZE_PX)
+        elapsed = (time.perf_counter() - start) / len(boxes)
+        best = elapsed if best is None else min(best, elapsed)
+
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    print("{0} {1} {2}".format(mode, best * 1000, peak_mb))
+
+
+def main():
+    chart_dir = sys.argv[1] if len(sys.argv) > 1 else None
+
+    if len(sys.argv) > 2:
+        runMode(sys.argv[2], None if chart_dir == "-" else chart_dir)
+        return
+
+    print("{0:>8} {1:>14} {2:>14}".format("mode", "ms per tile", "peak RSS (MB)"))
+    for mode in ["legacy", "current"]:
+        output = subprocess.run([sys.executable, __file__, chart_dir or "-", mode], capture_output=True, text=True, check=True).stdout
+        name, tile_ms, peak_mb = output.strip().split("\n")[-1].split(" ")
+        print("{0:>8} {1:>14.2f} {2:>14.1f}".format(name, float(tile_ms), float(peak_mb)))
+
+
+if __name__ == '__main__':
+    main()
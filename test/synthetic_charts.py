@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+
+"""
+Generates synthetic NOAA-like charts for benchmarks, since the real ENCs can't be shipped with the repo
+
+Charts are GeoPackages named <NAME>/<NAME>.000, which ogr.Open reads the same way as S-57 cells. Each one has the layers
+NOAALayer cares about: DSID (scale and usage band), M_COVR, DEPARE with depths, LNDARE, COALNE and SOUNDG.
+"""
+
+import math
+import os
+import random
+
+from osgeo import ogr, osr
+
+# Name: (charts per side, depth cells per chart side)
+CHART_SET_SIZES = {"small": (2, 8),
+                   "medium": (4, 24),
+                   "large": (8, 48)}
+
+# Same area as the Woods Hole test data
+CHART_SET_LOWER_LEFT = [41.45, -70.80]
+CHART_SET_UPPER_RIGHT = [41.60, -70.55]
+
+USAGE_BAND_SCALES = {3: 80000, 4: 20000, 5: 10000}
+
+
+def makeChartSet(chart_dir, size="small", usage_band=5, seed=0):
+    """Writes a grid of charts covering CHART_SET_LOWER_LEFT to CHART_SET_UPPER_RIGHT, and returns their names"""
+    if size not in CHART_SET_SIZES:
+        raise Exception("unknown chart set size: %s" % size)
+
+    charts_per_side, cells_per_side = CHART_SET_SIZES[size]
+    random_generator = random.Random(seed)
+
+    lat_step = (CHART_SET_UPPER_RIGHT[0] - CHART_SET_LOWER_LEFT[0]) / charts_per_side
+    lon_step = (CHART_SET_UPPER_RIGHT[1] - CHART_SET_LOWER_LEFT[1]) / charts_per_side
+
+    chart_names = []
+    for i in range(charts_per_side):
+        for j in range(charts_per_side):
+            chart_name = "US{0}BM{1:03d}".format(usage_band, len(chart_names))
+            bounds = [CHART_SET_LOWER_LEFT[1] + j * lon_step, CHART_SET_LOWER_LEFT[1] + (j + 1) * lon_step,
+                      CHART_SET_LOWER_LEFT[0] + i * lat_step, CHART_SET_LOWER_LEFT[0] + (i + 1) * lat_step]
+
+            chart_path = os.path.join(chart_dir, chart_name, "{0}.000".format(chart_name))
+            makeChart(chart_path, bounds, cells_per_side, usage_band, random_generator)
+            chart_names.append(chart_name)
+
+    return chart_names
+
+
+def makeChart(chart_path, bounds, cells_per_side, usage_band, random_generator):
+    """One synthetic chart over bounds [lon_min, lon_max, lat_min, lat_max]"""
+    os.makedirs(os.path.dirname(chart_path), exist_ok=True)
+    if os.path.exists(chart_path):
+        os.remove(chart_path)
+
+    chart = ogr.GetDriverByName("GPKG").CreateDataSource(chart_path)
+    if chart is None:
+        raise Exception("could not create chart: %s" % chart_path)
+
+    spatial_reference = osr.SpatialReference()
+    spatial_reference.ImportFromEPSG(4326)
+    spatial_reference.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+
+    [lon_min, lon_max, lat_min, lat_max] = bounds
+    cell_width = (lon_max - lon_min) / cells_per_side
+    cell_height = (lat_max - lat_min) / cells_per_side
+
+    # Dataset record
+    dsid = chart.CreateLayer("DSID", None, ogr.wkbNone)
+    dsid.CreateField(ogr.FieldDefn("DSPM_CSCL", ogr.OFTInteger))
+    dsid.CreateField(ogr.FieldDefn("DSID_INTU", ogr.OFTInteger))
+    feature = ogr.Feature(dsid.GetLayerDefn())
+    feature.SetField("DSPM_CSCL", USAGE_BAND_SCALES.get(usage_band, 10000))
+    feature.SetField("DSID_INTU", usage_band)
+    dsid.CreateFeature(feature)
+
+    # Coverage
+    coverage = chart.CreateLayer("M_COVR", spatial_reference, ogr.wkbPolygon)
+    addFeature(coverage, makeBox(lon_min, lat_min, lon_max, lat_max))
+
+    # Depth areas are a grid of cells, with land wherever the depth comes out negative
+    depare = chart.CreateLayer("DEPARE", spatial_reference, ogr.wkbPolygon)
+    depare.CreateField(ogr.FieldDefn("DRVAL1", ogr.OFTReal))
+    depare.CreateField(ogr.FieldDefn("DRVAL2", ogr.OFTReal))
+    lndare = chart.CreateLayer("LNDARE", spatial_reference, ogr.wkbPolygon)
+    coalne = chart.CreateLayer("COALNE", spatial_reference, ogr.wkbLineString)
+    soundg = chart.CreateLayer("SOUNDG", spatial_reference, ogr.wkbPoint25D)
+
+    for layer in [depare, lndare, coalne, soundg]:
+        layer.StartTransaction()
+
+    for row in range(cells_per_side):
+        for column in range(cells_per_side):
+            cell_lon = lon_min + column * cell_width
+            cell_lat = lat_min + row * cell_height
+            depth = getSyntheticDepth(cell_lon + cell_width / 2, cell_lat + cell_height / 2)
+            cell = makeWobblyBox(cell_lon, cell_lat, cell_width, cell_height, random_generator)
+
+            if depth < 0:
+                addFeature(lndare, cell)
+                addFeature(coalne, cell.GetGeometryRef(0).Clone())
+            else:
+                drval1 = math.floor(depth / 5) * 5
+                addFeature(depare, cell, {"DRVAL1": drval1, "DRVAL2": drval1 + 5})
+
+                sounding = ogr.Geometry(ogr.wkbPoint25D)
+                sounding.AddPoint(cell_lon + cell_width * random_generator.random(), cell_lat + cell_height * random_generator.random(), depth)
+                addFeature(soundg, sounding)
+
+    for layer in [depare, lndare, coalne, soundg]:
+        layer.CommitTransaction()
+
+    chart = None
+
+
+def getSyntheticDepth(lon, lat):
+    """Smooth made up bathymetry in meters, negative on land"""
+    return 12 + 10 * math.sin(lon * 180) * math.cos(lat * 150) + 6 * math.sin((lon + lat) * 420)
+
+
+def makeBox(x_min, y_min, x_max, y_max):
+    ring = ogr.Geometry(ogr.wkbLinearRing)
+    for x, y in [(x_min, y_min), (x_max, y_min), (x_max, y_max), (x_min, y_max), (x_min, y_min)]:
+        ring.AddPoint_2D(x, y)
+
+    polygon = ogr.Geometry(ogr.wkbPolygon)
+    polygon.AddGeometry(ring)
+    return polygon
+
+
+def makeWobblyBox(x_min, y_min, width, height, random_generator, points_per_side=16):
+    """Cell polygon with jittered edge vertices, so it has a realistic number of points to simplify and rasterize"""
+    corners = [(x_min, y_min), (x_min + width, y_min), (x_min + width, y_min + height), (x_min, y_min + height)]
+    jitter = min(width, height) * 0.02
+
+    ring = ogr.Geometry(ogr.wkbLinearRing)
+    for side in range(4):
+        (x0, y0), (x1, y1) = corners[side], corners[(side + 1) % 4]
+        for k in range(points_per_side):
+            t = k / points_per_side
+            offset = 0 if k == 0 else random_generator.uniform(-jitter, jitter)
+            ring.AddPoint_2D(x0 + (x1 - x0) * t + offset * (y1 - y0) / height, y0 + (y1 - y0) * t + offset * (x1 - x0) / width)
+    ring.CloseRings()
+
+    polygon = ogr.Geometry(ogr.wkbPolygon)
+    polygon.AddGeometry(ring)
+    return polygon
+
+
+def addFeature(layer, geometry, fields=None):
+    feature = ogr.Feature(layer.GetLayerDefn())
+    feature.SetGeometry(geometry)
+    for key, value in (fields or {}).items():
+        feature.SetField(key, value)
+    layer.CreateFeature(feature)
+
+
+if __name__ == '__main__':
+    import sys
+
+    output_dir = sys.argv[1] if len(sys.argv) > 1 else "synthetic_charts"
+    set_size = sys.argv[2] if len(sys.argv) > 2 else "small"
+    print("Wrote {0} charts to {1}".format(len(makeChartSet(output_dir, set_size)), output_dir))